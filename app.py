@@ -0,0 +1,76 @@
+import gc
+import os
+from collections import namedtuple
+
+from metrics import InstrumentedRedis
+from redis_shards import ShardRouter, get_redis_urls
+from state_store import ConversationStateStore, STATE_TTL
+from tenants import set_tenant
+from token_manager import MoltinTokenManager
+
+Config = namedtuple('Config', [
+    'tenant',
+    'telegram_token',
+    'chat_id',
+    'redis_shards',
+    'moltin_client_id',
+    'moltin_client_secret',
+    'yandex_apikey',
+    'state_ttl',
+    'state_write_behind',
+    'metrics_port',
+    'telegram_api_url',
+    'trace_updates',
+    'preload',
+])
+
+
+def load_config(env):
+    return Config(
+        tenant=env.str('TENANT', ''),
+        telegram_token=env.str('TELEGRAM_TOKEN'),
+        chat_id=env.str('CHAT_ID'),
+        redis_shards=tuple(get_redis_urls(env)),
+        moltin_client_id=env.str('MOLTIN_CLIENT_ID'),
+        moltin_client_secret=env.str('MOLTIN_CLIENT_SECRET'),
+        yandex_apikey=env.str('YANDEX_GEO_APIKEY', None),
+        state_ttl=env.int('STATE_TTL', STATE_TTL),
+        state_write_behind=env.bool('STATE_WRITE_BEHIND', False),
+        metrics_port=env.int('METRICS_PORT', 0),
+        telegram_api_url=env.str('TELEGRAM_API_URL', None),
+        trace_updates=env.bool('TRACE_UPDATES', False),
+        preload=env.bool('PRELOAD', False),
+    )
+
+
+class App:
+    def __init__(self, config, handlers):
+        self.config = config
+        self.handlers = handlers
+        self.tenant = set_tenant(config.tenant)
+        self.shards = ShardRouter.from_urls(config.redis_shards,
+                                            InstrumentedRedis)
+        self.database = self.shards.get_tenant_shard()
+        self.state_store = ConversationStateStore(
+            self.database,
+            ttl=config.state_ttl,
+            write_behind=config.state_write_behind,
+            get_chat_database=self.shards.get_chat_shard
+        )
+        self.token_manager = MoltinTokenManager(config.moltin_client_id,
+                                                config.moltin_client_secret,
+                                                self.database)
+        os.register_at_fork(after_in_child=self.restart_after_fork)
+
+    def get_moltin_api_token(self):
+        self.token_manager.start()
+        return self.token_manager.get_token()
+
+    def preload(self, *warmers):
+        for warm in warmers:
+            warm(self)
+        gc.freeze()
+
+    def restart_after_fork(self):
+        self.token_manager.restart_after_fork()
+        self.state_store.restart_after_fork()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import redis.asyncio as aioredis
+
+from redis_shards import ShardRouter
+from state_store import AsyncConversationStateStore, STATE_TTL
+
+# Only getUpdates and the conversation state are awaited here. The state
+# handlers still make blocking Moltin, Yandex and Telegram calls, so they
+# run on a pool of ASYNC_WORKERS threads: a slow upstream holds one thread
+# and one chat, not the whole dispatch loop.
+ASYNC_WORKERS = 100
+POLLING_TIMEOUT = 30
+
+logger = logging.getLogger('tg_logger')
+
+
+class ChatDispatcher:
+    def __init__(self, bot, state_store, get_update_chat, run_state_handler,
+                 executor, notify_failure=None):
+        self.bot = bot
+        self.state_store = state_store
+        self.get_update_chat = get_update_chat
+        self.run_state_handler = run_state_handler
+        self.executor = executor
+        self.notify_failure = notify_failure
+        self._locks = {}
+        self._pending = {}
+        self._tasks = set()
+
+    def submit(self, update):
+        task = asyncio.ensure_future(self.handle_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    async def handle_update(self, update):
+        chat_id, user_reply = self.get_update_chat(update)
+        if chat_id is None:
+            return
+
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await self.process_update(chat_id, user_reply, update)
+        finally:
+            self._pending[chat_id] -= 1
+            if not self._pending[chat_id]:
+                del self._pending[chat_id]
+                del self._locks[chat_id]
+
+    async def process_update(self, chat_id, user_reply, update):
+        loop = asyncio.get_running_loop()
+        try:
+            if user_reply == '/start':
+                user_state = 'START'
+            else:
+                user_state = await self.state_store.get_state(chat_id) or \
+                    'START'
+            next_state = await loop.run_in_executor(
+                self.executor,
+                self.run_state_handler, self.bot, update, user_state
+            )
+            await self.state_store.set_state(chat_id, next_state)
+        except Exception:
+            logger.exception('Update %s failed', update.update_id)
+            if self.notify_failure is not None:
+                await loop.run_in_executor(self.executor, self.notify_failure,
+                                           self.bot, chat_id)
+
+
+async def poll_updates(bot, dispatcher, executor, timeout=POLLING_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    offset = None
+    while True:
+        try:
+            updates = await loop.run_in_executor(
+                executor,
+                partial(bot.get_updates, offset=offset, timeout=timeout)
+            )
+        except Exception:
+            logger.exception('getUpdates failed')
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            offset = update.update_id + 1
+            dispatcher.submit(update)
+
+
+async def run_bot(bot, database_urls, get_update_chat, run_state_handler,
+                  workers=ASYNC_WORKERS, notify_failure=None,
+                  state_ttl=STATE_TTL):
+    executor = ThreadPoolExecutor(max_workers=workers)
+    polling_executor = ThreadPoolExecutor(max_workers=1)
+    shards = ShardRouter.from_urls(database_urls, aioredis.Redis)
+    state_store = AsyncConversationStateStore(
+        shards.get_tenant_shard(),
+        ttl=state_ttl,
+        get_chat_database=shards.get_chat_shard
+    )
+    dispatcher = ChatDispatcher(bot, state_store, get_update_chat,
+                                run_state_handler, executor,
+                                notify_failure=notify_failure)
+    try:
+        await poll_updates(bot, dispatcher, polling_executor)
+    finally:
+        await dispatcher.join()
+        for database in shards:
+            await database.close()
+        executor.shutdown()
+        polling_executor.shutdown()
+
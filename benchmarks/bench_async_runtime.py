@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import redis.asyncio as aioredis
+
+from async_runtime import ASYNC_WORKERS, ChatDispatcher
+from benchmarks.fake_upstreams import FakeUpstreams, load_fixture
+from benchmarks.load_test import STEPS, build_report, configure_bot, \
+    count_handler_errors, make_journey, print_report, run_journey
+from redis_shards import get_redis_url
+from state_store import AsyncConversationStateStore
+
+
+async def run(tg_bot, bot, journeys, database_url, workers):
+    from telegram import Update
+
+    steps = {}
+    updates = []
+    # Submit step by step, so every chat has its next update queued while
+    # the others are being handled.
+    for step_number in range(len(STEPS)):
+        for journey in journeys:
+            step, update_data = journey[step_number]
+            update = Update.de_json(update_data, bot)
+            steps[update.update_id] = step
+            updates.append(update)
+
+    latencies = defaultdict(list)
+    seen = defaultdict(list)
+
+    def run_state_handler(bot, update, user_state):
+        chat_id, _ = tg_bot.get_update_chat(update)
+        seen[chat_id].append(update.update_id)
+        started_at = time.perf_counter()
+        try:
+            return tg_bot.run_state_handler(bot, update, user_state)
+        finally:
+            latencies[steps[update.update_id]].append(
+                time.perf_counter() - started_at)
+
+    database = aioredis.Redis.from_url(database_url)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    dispatcher = ChatDispatcher(bot, AsyncConversationStateStore(database),
+                                tg_bot.get_update_chat, run_state_handler,
+                                executor, notify_failure=tg_bot.notify_failure)
+    started_at = time.perf_counter()
+    for update in updates:
+        dispatcher.submit(update)
+    await dispatcher.join()
+    elapsed = time.perf_counter() - started_at
+    executor.shutdown()
+    await database.close()
+
+    ordered = all(ids == sorted(ids) for ids in seen.values())
+    return latencies, elapsed, ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run user journeys through the asyncio runtime against '
+                    'fake Moltin, Telegram and Yandex servers')
+    parser.add_argument('--journeys', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=ASYNC_WORKERS)
+    parser.add_argument('--upstream-latency', type=float, default=0.05,
+                        help='seconds added to every fake upstream response')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-db', type=int, default=15,
+                        help='flushed before the run')
+    parser.add_argument('--menu', default='menu.json')
+    parser.add_argument('--addresses', default='address.json')
+    parser.add_argument('--throttle', action='store_true',
+                        help='apply the Telegram send quotas to the bot')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(load_fixture(args.menu),
+                              load_fixture(args.addresses),
+                              latency=args.upstream_latency)
+    tg_bot, bot = configure_bot(upstreams.start(), args.redis_host,
+                                args.redis_port, args.redis_db,
+                                throttle=args.throttle)
+    for database in tg_bot.get_app().shards:
+        database.flushdb()
+
+    products = list(upstreams.products.values())
+    journeys = [make_journey(number, products, upstreams.pizzerias)
+                for number in range(args.warmup + args.journeys)]
+
+    for journey in journeys[:args.warmup]:
+        run_journey(tg_bot, bot, journey, defaultdict(list))
+    upstreams.reset_calls()
+
+    handler_errors = count_handler_errors()
+    latencies, elapsed, ordered = asyncio.run(run(
+        tg_bot, bot, journeys[args.warmup:],
+        get_redis_url(args.redis_host, args.redis_port, args.redis_db),
+        args.workers))
+    upstreams.stop()
+    errors = count_handler_errors() - handler_errors
+
+    report = build_report(latencies, upstreams.reset_calls(), args.journeys,
+                          args.journeys * len(STEPS), errors, elapsed)
+    report['per_chat_order_kept'] = ordered
+    report['serial_handler_seconds'] = sum(map(sum, latencies.values()))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        print(f'per-chat order kept: {ordered}')
+        print(f'serial dispatch would take '
+              f'{report["serial_handler_seconds"]:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
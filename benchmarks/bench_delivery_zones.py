@@ -0,0 +1,66 @@
+import argparse
+import random
+import time
+
+from delivery_zones import DeliveryZones, load_zones_config
+from pizzeria_index import PizzeriaIndex, haversine_km, \
+    load_pizzerias_from_file
+
+
+def quote_with_loop(pizzerias, latitude, longitude):
+    distances = [
+        haversine_km(latitude, longitude,
+                     pizzeria.latitude, pizzeria.longitude)
+        for pizzeria in pizzerias
+    ]
+    distance = min(distances)
+    if distance <= 0.5:
+        return 0
+    elif 0.5 < distance <= 5:
+        return 100
+    elif 5 < distance <= 20:
+        return 300
+    return None
+
+
+def measure(name, function, points):
+    started_at = time.perf_counter()
+    prices = [function(latitude, longitude) for latitude, longitude in points]
+    elapsed = time.perf_counter() - started_at
+    print(f'{name}: {elapsed:.2f}s, '
+          f'{elapsed / len(points) * 1e6:.1f} us per address')
+    return prices
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    pizzerias = load_pizzerias_from_file()
+    points = [
+        (55.75 + random.uniform(-0.4, 0.4), 37.6 + random.uniform(-0.6, 0.6))
+        for _ in range(args.addresses)
+    ]
+
+    zones = DeliveryZones(PizzeriaIndex(pizzerias), load_zones_config())
+    started_at = time.perf_counter()
+    zones.precompute()
+    print(f'precompute: {time.perf_counter() - started_at:.2f}s, '
+          f'{len(zones.table)} cells')
+
+    expected = measure('current loop', lambda lat, lon: quote_with_loop(
+        pizzerias, lat, lon), points)
+
+    def get_price(latitude, longitude):
+        tier = zones.quote(latitude, longitude).tier
+        return tier['price'] if tier else None
+
+    measure('zones, first pass', get_price, points)
+    prices = measure('zones, warm table', get_price, points)
+    assert prices == expected
+
+
+if __name__ == '__main__':
+    main()
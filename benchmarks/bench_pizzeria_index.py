@@ -0,0 +1,64 @@
+import argparse
+import random
+import time
+
+from catalog_model import Outlet
+from pizzeria_index import PizzeriaIndex, haversine_km, \
+    load_pizzerias_from_file
+
+
+def scan_nearest(pizzerias, latitude, longitude):
+    return min(
+        haversine_km(latitude, longitude,
+                     pizzeria.latitude, pizzeria.longitude)
+        for pizzeria in pizzerias
+    )
+
+
+def generate_pizzerias(count):
+    return [
+        Outlet(alias=f'pizzeria-{number}', address='',
+               latitude=random.uniform(43, 60),
+               longitude=random.uniform(30, 60))
+        for number in range(count)
+    ]
+
+
+def measure(name, function, points):
+    started_at = time.perf_counter()
+    for latitude, longitude in points:
+        function(latitude, longitude)
+    elapsed = time.perf_counter() - started_at
+    print(f'{name}: {elapsed / len(points) * 1e6:.1f} us per lookup')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--outlets', type=int, default=0,
+                        help='generate random outlets instead of address.json')
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    if args.outlets:
+        pizzerias = generate_pizzerias(args.outlets)
+    else:
+        pizzerias = load_pizzerias_from_file()
+    points = [
+        (pizzeria.latitude + random.uniform(-0.1, 0.1),
+         pizzeria.longitude + random.uniform(-0.1, 0.1))
+        for pizzeria in random.choices(pizzerias, k=args.queries)
+    ]
+
+    started_at = time.perf_counter()
+    index = PizzeriaIndex(pizzerias)
+    print(f'{len(index)} outlets indexed in '
+          f'{(time.perf_counter() - started_at) * 1000:.1f} ms')
+
+    measure('linear scan', lambda lat, lon: scan_nearest(pizzerias, lat, lon),
+            points)
+    measure('grid index', index.nearest, points)
+
+
+if __name__ == '__main__':
+    main()
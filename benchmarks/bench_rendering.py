@@ -0,0 +1,138 @@
+import argparse
+import json
+import time
+from textwrap import dedent
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from benchmarks.fake_upstreams import FakeUpstreams, load_fixture
+from catalog_cache import get_cached
+from catalog_model import parse_products
+from render_cache import render_cart, render_menu_keyboard, \
+    render_product_card
+
+
+def build_legacy_menu_keyboard(products):
+    keyboard = [[InlineKeyboardButton(product['name'],
+                                      callback_data=product['id'])]
+                for product in products]
+    keyboard.append([InlineKeyboardButton('Корзина',
+                                          callback_data='cart_items')])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def render_legacy_card(product):
+    text = f'''\
+        {product['name']} \n
+        Стоимость: {product['price'][0]['amount']} руб
+
+        {product['description']}
+        '''
+    keyboard = [[InlineKeyboardButton("Положить в корзину",
+                                      callback_data=product["id"])],
+                [InlineKeyboardButton('Назад', callback_data='back-to-menu')]]
+    return dedent(text), InlineKeyboardMarkup(keyboard).to_json()
+
+
+def render_legacy_cart(cart):
+    cart_info = ''
+    for product in cart['data']:
+        text = f'''
+            {product['name']}
+            {product['description']}
+            {product['quantity']} пицц в корзине на сумму {product['meta']['display_price']['with_tax']['value']['formatted']} \n
+            '''
+        cart_info = cart_info + text
+    cart_price = cart['meta']['display_price']['with_tax']['formatted']
+    cart_info = cart_info + f'К оплате: {cart_price}'
+
+    keyboard = []
+    for product in cart['data']:
+        keyboard.append([InlineKeyboardButton(
+            f'Убрать из корзины {product["name"]}',
+            callback_data=product['id'])])
+    keyboard.append([InlineKeyboardButton('Назад',
+                                          callback_data='back-to-menu')])
+    keyboard.append([InlineKeyboardButton(
+        'Оплатить',
+        callback_data='waiting_user_location'
+    )])
+    return dedent(cart_info), InlineKeyboardMarkup(keyboard).to_json()
+
+
+def build_rendered_catalog(products):
+    products = parse_products(products)
+    return {
+        'menu_keyboard': render_menu_keyboard(products),
+        'cards': {product.id: render_product_card(product)
+                  for product in products},
+    }
+
+
+def measure(function, iterations):
+    started_at = time.process_time()
+    for number in range(iterations):
+        function(number)
+    return (time.process_time() - started_at) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--cart-items', type=int, default=5)
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(load_fixture('menu.json'),
+                              load_fixture('address.json'))
+    products = list(upstreams.products.values())
+    for product in products[:args.cart_items]:
+        upstreams.route_cart('POST', 'bench', [],
+                             {'data': {'id': product['id'], 'quantity': 1}})
+    _, cart = upstreams.route_cart('GET', 'bench', [], {})
+
+    rendered_catalog = get_cached(('bench_rendered_catalog',),
+                                  build_rendered_catalog, products)
+
+    for product in products:
+        card = rendered_catalog['cards'][product['id']]
+        caption, reply_markup = render_legacy_card(product)
+        assert card['caption'] == caption
+        assert json.loads(card['reply_markup']) == json.loads(reply_markup)
+    cart_info, reply_markup = render_cart(cart)
+    legacy_cart_info, legacy_reply_markup = render_legacy_cart(cart)
+    assert cart_info == legacy_cart_info
+    assert json.loads(reply_markup) == json.loads(legacy_reply_markup)
+
+    def legacy_menu(number):
+        get_cached(('bench_legacy_keyboard',), build_legacy_menu_keyboard,
+                   products).to_json()
+
+    def rendered_menu(number):
+        get_cached(('bench_rendered_catalog',), build_rendered_catalog,
+                   products)['menu_keyboard']
+
+    def legacy_card(number):
+        render_legacy_card(products[number % len(products)])
+
+    def rendered_card(number):
+        product_id = products[number % len(products)]['id']
+        get_cached(('bench_rendered_catalog',), build_rendered_catalog,
+                   products)['cards'][product_id]
+
+    cases = (
+        ('menu keyboard', legacy_menu, rendered_menu),
+        ('product card', legacy_card, rendered_card),
+        (f'cart ({args.cart_items} items)',
+         lambda number: render_legacy_cart(cart),
+         lambda number: render_cart(cart)),
+    )
+    print(f'{len(products)} products, CPU per update:')
+    for name, legacy, rendered in cases:
+        before = measure(legacy, args.iterations)
+        after = measure(rendered, args.iterations)
+        print(f'{name:<16} before {before * 1e6:7.1f} us, '
+              f'after {after * 1e6:7.1f} us ({before / after:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
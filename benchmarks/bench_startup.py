@@ -0,0 +1,80 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ('tg_bot', 'pizza_data', 'order_pipeline', 'media_cache')
+
+
+def time_import(module, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def get_heaviest_imports(module, count):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            check=True, capture_output=True, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def time_fork_ready(runs):
+    from environs import Env
+
+    import tg_bot
+    from app import load_config
+
+    app = tg_bot.create_app(load_config(Env()))
+    timings = []
+    for _ in range(runs):
+        read_fd, write_fd = os.pipe()
+        started_at = time.perf_counter()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            app.database.ping()
+            os.write(write_fd, b'1')
+            os._exit(0)
+        os.close(write_fd)
+        os.read(read_fd, 1)
+        os.close(read_fd)
+        timings.append(time.perf_counter() - started_at)
+        os.waitpid(pid, 0)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--fork', action='store_true',
+                        help='needs the bot settings and a running redis')
+    args = parser.parse_args()
+
+    for module in MODULES:
+        elapsed = time_import(module, args.runs)
+        print(f'import {module:<16} {elapsed * 1e3:7.1f} ms (median)')
+
+    print('\nheaviest imports of tg_bot, cumulative:')
+    for cumulative, name in get_heaviest_imports('tg_bot', args.top):
+        print(f'{cumulative / 1e3:8.1f} ms  {name}')
+
+    if args.fork:
+        elapsed = time_fork_ready(args.runs)
+        print(f'\nforked worker ready in {elapsed * 1e3:.1f} ms (median)')
+
+
+if __name__ == '__main__':
+    main()
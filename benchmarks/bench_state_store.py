@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import redis
+
+from state_store import ConversationStateStore
+
+STATES = ['START', 'HANDLE_MENU', 'HANDLE_DESCRIPTION', 'HANDLE_CART']
+
+
+def run_legacy_update(database, chat_id, state):
+    database.get('moltin_api_token')
+    database.get('moltin_api_token')
+    database.get(chat_id)
+    database.set(chat_id, state)
+
+
+def run_store_update(state_store, chat_id, state):
+    state_store.get_state(chat_id)
+    state_store.set_state(chat_id, state)
+
+
+def measure(name, database, run_update, target, chats, updates):
+    database.flushdb()
+    memory_before = database.info('memory')['used_memory']
+
+    started_at = time.perf_counter()
+    for number in range(updates):
+        chat_id = 100000000 + number % chats
+        run_update(target, chat_id, STATES[number % len(STATES)])
+    if isinstance(target, ConversationStateStore):
+        target.flush()
+    elapsed = time.perf_counter() - started_at
+
+    memory = database.info('memory')['used_memory'] - memory_before
+    print(f'{name}: {elapsed / updates * 1e6:.0f} us per update, '
+          f'{memory / chats:.0f} bytes per chat')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15)
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--updates', type=int, default=50000)
+    args = parser.parse_args()
+
+    database = redis.Redis(host=args.host, port=args.port, db=args.db)
+    database.set('moltin_api_token', 'token')
+
+    measure('bare keys, 4 round trips', database, run_legacy_update,
+            database, args.chats, args.updates)
+    measure('state store, pipelined', database, run_store_update,
+            ConversationStateStore(database), args.chats, args.updates)
+    measure('state store, write-behind', database, run_store_update,
+            ConversationStateStore(database, write_behind=True),
+            args.chats, args.updates)
+    database.flushdb()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+IMAGE_URL = 'https://fake-upstreams.local/images/{}.jpg'
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections once a hundred handler
+    # threads hit the fakes at once.
+    request_queue_size = 1024
+
+
+def load_fixture(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def format_price(amount):
+    return f'{amount} ₽'
+
+
+def paginate(items, query, headers):
+    limit = int(query.get('page[limit]', ['100'])[0])
+    offset = int(query.get('page[offset]', ['0'])[0])
+    page = {
+        'data': items[offset:offset + limit],
+        'meta': {'results': {'total': len(items)}},
+    }
+    etag = '"{}"'.format(hashlib.sha1(
+        json.dumps(page, sort_keys=True).encode('utf-8')).hexdigest())
+    if headers.get('If-None-Match') == etag:
+        return 304, None, {'ETag': etag}
+    return 200, page, {'ETag': etag}
+
+
+class FakeUpstreams:
+    def __init__(self, menu, addresses, latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self._carts_lock = threading.Lock()
+        self._message_ids = iter(range(1, 10 ** 12))
+        self.carts = {}
+        self.servers = []
+
+        self.products = {
+            str(item['id']): {
+                'id': str(item['id']),
+                'type': 'product',
+                'name': item['name'],
+                'description': item['description'],
+                'price': [{'amount': item['price'] * 100,
+                           'currency': 'RUB',
+                           'includes_tax': False}],
+                'relationships': {
+                    'main_image': {
+                        'data': {'type': 'main_image',
+                                 'id': f'image-{item["id"]}'},
+                    },
+                },
+            }
+            for item in menu
+        }
+        self.prices = {str(item['id']): item['price'] for item in menu}
+        self.images = {
+            f'image-{item["id"]}': item['product_image']['url']
+            for item in menu
+        }
+        self.pizzerias = [
+            {
+                'id': address['id'],
+                'type': 'entry',
+                'alias': address['alias'],
+                'address': address['address']['full'],
+                'latitude': address['coordinates']['lat'],
+                'longitude': address['coordinates']['lon'],
+            }
+            for address in addresses
+        ]
+        self.coordinates = {
+            pizzeria['address'].lower(): (pizzeria['latitude'],
+                                          pizzeria['longitude'])
+            for pizzeria in self.pizzerias
+        }
+
+    def count(self, service, name):
+        with self._calls_lock:
+            self.calls[service, name] += 1
+
+    def reset_calls(self):
+        with self._calls_lock:
+            calls = self.calls
+            self.calls = Counter()
+        return calls
+
+    def start(self, host='127.0.0.1'):
+        urls = {}
+        for service, route in (('moltin', self.route_moltin),
+                               ('telegram', self.route_telegram),
+                               ('yandex', self.route_yandex)):
+            server = FakeUpstreamServer((host, 0), make_handler(self, route))
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+            urls[service] = f'http://{host}:{server.server_port}'
+        return urls
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def route_moltin(self, method, path, query, body, headers):
+        parts = path.strip('/').split('/')
+        if parts == ['oauth', 'access_token']:
+            self.count('moltin', 'POST oauth')
+            return 200, {'access_token': 'fake-token', 'expires_in': 3600}
+        if len(parts) < 2 or parts[0] != 'v2':
+            return 404, {'errors': [{'title': 'Not found'}]}
+
+        endpoint = parts[1]
+        self.count('moltin', f'{method} {endpoint}')
+        if endpoint == 'products' and len(parts) == 2:
+            return paginate(list(self.products.values()), query, headers)
+        if endpoint == 'products':
+            product = self.products.get(parts[2])
+            if product is None:
+                return 404, {'errors': [{'title': 'Product not found'}]}
+            return 200, {'data': product}
+        if endpoint == 'files':
+            return 200, {'data': {
+                'id': parts[2],
+                'link': {'href': self.images.get(parts[2],
+                                                 IMAGE_URL.format(parts[2]))},
+            }}
+        if endpoint == 'flows' and parts[3:4] == ['entries']:
+            return paginate(self.pizzerias, query, headers)
+        if endpoint == 'carts' and parts[3:4] == ['checkout']:
+            return 201, {'data': {'type': 'order',
+                                  'id': f'order-{parts[2]}',
+                                  'customer': body['data']['customer']}}
+        if endpoint == 'carts':
+            return self.route_cart(method, parts[2], parts[4:], body)
+        if endpoint == 'customers' and method == 'GET':
+            return 200, {'data': []}
+        if endpoint == 'customers':
+            return 201, {'data': {'type': 'customer',
+                                  'id': f'customer-{len(self.carts)}',
+                                  'email': body['data']['email']}}
+        return 404, {'errors': [{'title': 'Not found'}]}
+
+    def route_cart(self, method, cart_id, item_path, body):
+        with self._carts_lock:
+            cart = self.carts.setdefault(cart_id, {})
+            if method == 'POST':
+                product_id = body['data']['id']
+                cart[product_id] = cart.get(product_id, 0) + \
+                    body['data'].get('quantity', 1)
+            elif method == 'DELETE' and item_path:
+                cart.pop(item_path[0], None)
+            elif method == 'DELETE':
+                cart.clear()
+            items = list(cart.items())
+
+        data = []
+        total = 0
+        for product_id, quantity in items:
+            product = self.products[product_id]
+            value = self.prices[product_id] * quantity
+            total += value
+            data.append({
+                'id': product_id,
+                'type': 'cart_item',
+                'product_id': product_id,
+                'name': product['name'],
+                'description': product['description'],
+                'quantity': quantity,
+                'meta': {'display_price': {'with_tax': {
+                    'value': {'amount': value * 100,
+                              'formatted': format_price(value)},
+                }}},
+            })
+        return 200, {'data': data, 'meta': {'display_price': {'with_tax': {
+            'amount': total * 100,
+            'formatted': format_price(total),
+        }}}}
+
+    def route_telegram(self, method, path, query, body, headers):
+        api_method = path.rsplit('/', 1)[-1]
+        self.count('telegram', api_method)
+        if api_method == 'deleteMessage':
+            return 200, {'ok': True, 'result': True}
+
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(body.get('chat_id', 0)), 'type': 'private'},
+        }
+        if api_method == 'sendPhoto':
+            file_id = f'file-{abs(hash(body.get("photo")))}'
+            message['photo'] = [{'file_id': file_id,
+                                 'file_unique_id': file_id,
+                                 'width': 800,
+                                 'height': 800}]
+            message['caption'] = body.get('caption', '')
+        else:
+            message['text'] = body.get('text', '')
+        return 200, {'ok': True, 'result': message}
+
+    def route_yandex(self, method, path, query, body, headers):
+        self.count('yandex', 'geocode')
+        address = query.get('geocode', [''])[0].strip().lower()
+        coordinates = self.coordinates.get(address)
+        feature_members = []
+        if coordinates is not None:
+            latitude, longitude = coordinates
+            feature_members.append(
+                {'GeoObject': {'Point': {'pos': f'{longitude} {latitude}'}}})
+        return 200, {'response': {'GeoObjectCollection': {
+            'featureMember': feature_members,
+        }}}
+
+
+def parse_body(handler):
+    length = int(handler.headers.get('Content-Length') or 0)
+    if not length:
+        return {}
+    raw_body = handler.rfile.read(length)
+    content_type = handler.headers.get('Content-Type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(raw_body)
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        return {key: values[0] for key, values in
+                parse_qs(raw_body.decode('utf-8')).items()}
+    return {}
+
+
+def make_handler(upstreams, route):
+    class FakeUpstreamHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_request(self):
+            url = urlparse(self.path)
+            body = parse_body(self)
+            if upstreams.latency:
+                time.sleep(upstreams.latency)
+            status, payload, *headers = route(self.command, url.path,
+                                              parse_qs(url.query), body,
+                                              self.headers)
+            response = b''
+            if payload is not None:
+                response = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            for name, value in (headers[0] if headers else {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeUpstreamHandler
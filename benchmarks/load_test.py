@@ -0,0 +1,225 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_upstreams import FakeUpstreams, load_fixture
+from redis_shards import get_redis_url
+
+CHAT_ID_OFFSET = 900000000
+STEPS = ('start', 'product', 'add', 'menu', 'cart', 'checkout', 'location')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def make_message(chat_id, message_id, **fields):
+    return {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+        **fields,
+    }
+
+
+def make_callback(update_id, chat_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': make_message(chat_id, update_id, text='menu'),
+        },
+    }
+
+
+def make_journey(number, products, pizzerias):
+    chat_id = CHAT_ID_OFFSET + number
+    update_ids = itertools.count(number * len(STEPS) + 1)
+    product = products[number % len(products)]
+    pizzeria = pizzerias[number % len(pizzerias)]
+    if number % 2:
+        location = {'text': pizzeria['address']}
+    else:
+        location = {'location': {'latitude': float(pizzeria['latitude']),
+                                 'longitude': float(pizzeria['longitude'])}}
+
+    start_id = next(update_ids)
+    updates = [{'update_id': start_id,
+                'message': make_message(chat_id, start_id, text='/start')}]
+    for data in (product['id'], product['id'], 'back-to-menu', 'cart_items',
+                 'waiting_user_location'):
+        updates.append(make_callback(next(update_ids), chat_id, data))
+    location_id = next(update_ids)
+    updates.append({'update_id': location_id,
+                    'message': make_message(chat_id, location_id, **location)})
+    return list(zip(STEPS, updates))
+
+
+def configure_bot(urls, redis_host, redis_port, redis_db, throttle=False):
+    os.environ['MOLTIN_API_URL'] = urls['moltin']
+    os.environ['YANDEX_GEOCODER_URL'] = f'{urls["yandex"]}/1.x'
+    os.environ.setdefault('MOLTIN_CLIENT_ID', 'load-test')
+    os.environ.setdefault('MOLTIN_CLIENT_SECRET', 'load-test')
+    os.environ.setdefault('YANDEX_GEO_APIKEY', 'load-test')
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:load-test')
+    os.environ.setdefault('CHAT_ID', '0')
+    os.environ['REDIS_HOST'] = redis_host
+    os.environ['REDIS_PORT'] = str(redis_port)
+    os.environ['REDIS_DB'] = str(redis_db)
+    # REDIS_SHARDS wins over REDIS_HOST, and a TENANT left in the shell
+    # would prefix every key, so both are pinned to the benchmark redis.
+    os.environ['REDIS_SHARDS'] = get_redis_url(redis_host, redis_port,
+                                               redis_db)
+    os.environ['TENANT'] = ''
+
+    # The upstream URLs are read at import time, so the bot modules are
+    # imported only after the fake servers are listening.
+    from environs import Env
+    from telegram import Bot
+
+    import tg_bot
+    from app import load_config
+    from send_scheduler import throttle_bot
+
+    tg_bot.create_app(load_config(Env()))
+    bot = Bot('123456:load-test', base_url=f'{urls["telegram"]}/bot')
+    if throttle:
+        throttle_bot(bot)
+    return tg_bot, bot
+
+
+def run_journey(tg_bot, bot, journey, latencies):
+    from telegram import Update
+
+    errors = 0
+    started_at = time.perf_counter()
+    for step, update_data in journey:
+        update = Update.de_json(update_data, bot)
+        step_started_at = time.perf_counter()
+        try:
+            tg_bot.handle_users_reply(bot, update)
+        except Exception:
+            errors += 1
+        latencies[step].append(time.perf_counter() - step_started_at)
+    latencies['journey'].append(time.perf_counter() - started_at)
+    return errors
+
+
+def count_handler_errors():
+    from metrics import HANDLER_ERRORS
+
+    return sum(HANDLER_ERRORS.values.values())
+
+
+def build_report(latencies, calls, journeys, updates, errors, elapsed):
+    return {
+        'journeys': journeys,
+        'updates': updates,
+        'elapsed': elapsed,
+        'journeys_per_second': journeys / elapsed,
+        'updates_per_second': updates / elapsed,
+        'errors': errors,
+        'latency_ms': {
+            step: {
+                'p50': percentile(values, 0.50) * 1000,
+                'p95': percentile(values, 0.95) * 1000,
+                'p99': percentile(values, 0.99) * 1000,
+            }
+            for step, values in latencies.items()
+        },
+        'upstream_calls_per_journey': {
+            f'{service} {name}': count / journeys
+            for (service, name), count in sorted(calls.items())
+        },
+    }
+
+
+def print_report(report):
+    print(f'{report["journeys"]} journeys ({report["updates"]} updates) in '
+          f'{report["elapsed"]:.2f}s: '
+          f'{report["journeys_per_second"]:.1f} journeys/s, '
+          f'{report["updates_per_second"]:.1f} updates/s, '
+          f'{report["errors"]} errors')
+    print(f'{"step":<10} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+    for step in STEPS + ('journey',):
+        latency = report['latency_ms'].get(step)
+        if latency is None:
+            continue
+        print(f'{step:<10} {latency["p50"]:>9.1f} {latency["p95"]:>9.1f} '
+              f'{latency["p99"]:>9.1f}')
+    print('upstream calls per journey:')
+    for name, count in report['upstream_calls_per_journey'].items():
+        print(f'  {name:<24} {count:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay user journeys against fake Moltin, Telegram and '
+                    'Yandex servers')
+    parser.add_argument('--journeys', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--upstream-latency', type=float, default=0,
+                        help='seconds every fake upstream call takes')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='journeys run before measuring')
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-db', type=int, default=15,
+                        help='the database is flushed before the run')
+    parser.add_argument('--menu', default='menu.json')
+    parser.add_argument('--addresses', default='address.json')
+    parser.add_argument('--throttle', action='store_true',
+                        help='apply the Telegram send quotas to the bot')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(load_fixture(args.menu),
+                              load_fixture(args.addresses),
+                              latency=args.upstream_latency)
+    tg_bot, bot = configure_bot(upstreams.start(), args.redis_host,
+                                args.redis_port, args.redis_db,
+                                throttle=args.throttle)
+    for database in tg_bot.get_app().shards:
+        database.flushdb()
+
+    products = list(upstreams.products.values())
+    journeys = [make_journey(number, products, upstreams.pizzerias)
+                for number in range(args.warmup + args.journeys)]
+
+    for journey in journeys[:args.warmup]:
+        run_journey(tg_bot, bot, journey, defaultdict(list))
+    upstreams.reset_calls()
+
+    handler_errors = count_handler_errors()
+    latencies = defaultdict(list)
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        errors = sum(executor.map(
+            lambda journey: run_journey(tg_bot, bot, journey, latencies),
+            journeys[args.warmup:]))
+    elapsed = time.perf_counter() - started_at
+    upstreams.stop()
+    errors += count_handler_errors() - handler_errors
+
+    report = build_report(latencies, upstreams.reset_calls(), args.journeys,
+                          args.journeys * len(STEPS), errors, elapsed)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
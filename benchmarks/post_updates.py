@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        },
+    }
+
+
+def post_update(url, update):
+    request = Request(url, data=json.dumps(update).encode('utf-8'),
+                      headers={'Content-Type': 'application/json'})
+    started_at = time.perf_counter()
+    with urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Post synthetic updates to a local webhook')
+    parser.add_argument('url', help='e.g. http://localhost:8443/<secret>')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--updates', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    updates = [
+        make_update(step * args.chats + chat, 100000000 + chat,
+                    '/start' if not step else str(step))
+        for step in range(args.updates)
+        for chat in range(args.chats)
+    ]
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = sorted(executor.map(
+            lambda update: post_update(args.url, update), updates))
+    elapsed = time.perf_counter() - started_at
+
+    print(f'{len(updates)} updates posted in {elapsed:.2f}s '
+          f'({len(updates) / elapsed:.0f}/s), '
+          f'p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
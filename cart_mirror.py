@@ -0,0 +1,63 @@
+import json
+from collections import Counter
+
+from tenants import get_key
+
+CART_KEY = 'cart:{}'
+CART_TTL = 60 * 60
+CART_GENERATION_KEY = 'cart_generation:{}'
+CART_GENERATION_TTL = 7 * 24 * 60 * 60
+
+cart_stats = Counter()
+
+
+def get_cart_key(chat_id):
+    return get_key(CART_KEY.format(chat_id))
+
+
+def get_cart_generation_key(chat_id):
+    return get_key(CART_GENERATION_KEY.format(chat_id))
+
+
+def get_cart_generation(database, chat_id):
+    return int(database.get(get_cart_generation_key(chat_id)) or 0)
+
+
+def bump_cart_generation(pipeline, chat_id):
+    # Every change to the cart starts a new generation, so a checkout of
+    # the same items after the cart was cleared is a new order.
+    pipeline.incr(get_cart_generation_key(chat_id))
+    pipeline.expire(get_cart_generation_key(chat_id), CART_GENERATION_TTL)
+
+
+def save_cart(database, chat_id, cart):
+    if 'data' not in cart or 'meta' not in cart:
+        forget_cart(database, chat_id)
+        return
+    pipeline = database.pipeline()
+    pipeline.set(get_cart_key(chat_id), json.dumps(cart), ex=CART_TTL)
+    bump_cart_generation(pipeline, chat_id)
+    pipeline.execute()
+
+
+def forget_cart(database, chat_id):
+    pipeline = database.pipeline()
+    pipeline.delete(get_cart_key(chat_id))
+    bump_cart_generation(pipeline, chat_id)
+    pipeline.execute()
+
+
+def get_mirrored_cart(database, chat_id, load_cart):
+    cached_cart = database.get(get_cart_key(chat_id))
+    if cached_cart is not None:
+        cart_stats['hits'] += 1
+        return json.loads(cached_cart)
+
+    cart_stats['misses'] += 1
+    return refresh_cart(database, chat_id, load_cart)
+
+
+def refresh_cart(database, chat_id, load_cart):
+    cart = load_cart()
+    save_cart(database, chat_id, cart)
+    return cart
@@ -0,0 +1,143 @@
+import time
+from collections import Counter, OrderedDict
+from threading import Lock, Thread
+
+from catalog_model import parse_product, parse_products
+from tenants import get_key
+from moltin_api import get_products_page, get_product, get_image_url
+
+CATALOG_TTL = 60 * 60
+CATALOG_MAX_SIZE = 4096
+VERSION_CHECK_INTERVAL = 30
+VERSION_KEY = 'catalog_version'
+
+_missing = object()
+
+catalog_stats = Counter()
+
+
+class TTLCache:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get_entry(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return _missing, 0
+            self._items.move_to_end(key)
+            return item
+
+    def get(self, key, default=None):
+        value, expires_at = self.get_entry(key)
+        if value is _missing or expires_at < time.monotonic():
+            return default
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value, time.monotonic() + self.ttl
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def expire(self):
+        with self._lock:
+            for key in list(self._items):
+                self._items[key] = self._items[key][0], 0
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_cache = TTLCache(CATALOG_TTL, CATALOG_MAX_SIZE)
+_known_version = None
+_version_checked_at = 0
+_refreshing = set()
+_refreshing_lock = Lock()
+
+
+def get_cached(key, loader, *args):
+    value, expires_at = _cache.get_entry(key)
+    if value is not _missing:
+        if expires_at >= time.monotonic():
+            catalog_stats['hits'] += 1
+            return value
+        if expires_at:
+            catalog_stats['stale'] += 1
+            refresh_in_background(key, loader, *args)
+            return value
+
+    catalog_stats['misses'] += 1
+    try:
+        fresh_value = loader(*args)
+    except Exception:
+        if value is _missing:
+            raise
+        catalog_stats['fallbacks'] += 1
+        return value
+    _cache.set(key, fresh_value)
+    return fresh_value
+
+
+def set_cached(key, value):
+    _cache.set(key, value)
+
+
+def refresh_in_background(key, loader, *args):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    Thread(target=refresh, args=(key, loader, *args), daemon=True).start()
+
+
+def refresh(key, loader, *args):
+    try:
+        _cache.set(key, loader(*args))
+    except Exception:
+        catalog_stats['refresh_errors'] += 1
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def load_products_page(offset, limit, moltin_api_token):
+    products, total = get_products_page(offset, limit, moltin_api_token)
+    return parse_products(products), total
+
+
+def load_product(product_id, moltin_api_token):
+    return parse_product(get_product(product_id, moltin_api_token))
+
+
+def get_cached_image_url(image_id, moltin_api_token):
+    return get_cached(('image_url', image_id),
+                      get_image_url, image_id, moltin_api_token)
+
+
+def invalidate_catalog(database=None):
+    _cache.expire()
+    if database is not None:
+        database.incr(get_key(VERSION_KEY))
+
+
+def check_catalog_version(database):
+    global _known_version, _version_checked_at
+
+    now = time.monotonic()
+    if now - _version_checked_at < VERSION_CHECK_INTERVAL:
+        return
+    _version_checked_at = now
+
+    version = database.get(get_key(VERSION_KEY))
+    if _known_version is not None and version != _known_version:
+        _cache.expire()
+    _known_version = version
@@ -0,0 +1,49 @@
+from collections import namedtuple
+
+
+class Product(namedtuple('Product', ['id', 'name', 'description', 'price',
+                                     'image_id'])):
+    __slots__ = ()
+
+
+class Outlet(namedtuple('Outlet', ['alias', 'address', 'latitude',
+                                   'longitude'])):
+    __slots__ = ()
+
+    @property
+    def city(self):
+        return self.address.split(',')[0].strip()
+
+
+def get_product_image_id(product):
+    main_image = product.get('relationships', {}).get('main_image')
+    if not main_image:
+        return None
+    return main_image['data']['id']
+
+
+def parse_product(product):
+    if isinstance(product, Product):
+        return product
+    return Product(
+        id=product['id'],
+        name=product['name'],
+        description=product['description'],
+        price=product['price'][0]['amount'],
+        image_id=get_product_image_id(product),
+    )
+
+
+def parse_products(products):
+    return tuple(parse_product(product) for product in products)
+
+
+def parse_outlet(pizzeria):
+    if isinstance(pizzeria, Outlet):
+        return pizzeria
+    return Outlet(
+        alias=pizzeria.get('alias', ''),
+        address=pizzeria.get('address', ''),
+        latitude=float(pizzeria['latitude']),
+        longitude=float(pizzeria['longitude']),
+    )
@@ -0,0 +1,95 @@
+import hashlib
+import json
+
+from moltin_api import get_product_sku
+from tenants import get_key
+
+IMAGE_SOURCES_KEY = 'catalog_sync:image_sources'
+
+
+def get_content_hash(*fields):
+    content = json.dumps([str(field).strip() for field in fields],
+                         ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def get_local_product_hash(product):
+    return get_content_hash(product['name'], product['description'],
+                            product['price'] * 100)
+
+
+def get_remote_product_hash(product):
+    return get_content_hash(product['name'], product['description'],
+                            product['price'][0]['amount'])
+
+
+def get_local_entry_hash(pizzeria_address):
+    return get_content_hash(pizzeria_address['address']['full'],
+                            pizzeria_address['coordinates']['lon'],
+                            pizzeria_address['coordinates']['lat'])
+
+
+def get_remote_entry_hash(entry):
+    return get_content_hash(entry.get('address'), entry.get('longitude'),
+                            entry.get('latitude'))
+
+
+def plan_products_sync(menu, remote_products, image_sources):
+    remote_by_sku = {product['sku']: product for product in remote_products}
+    plan = []
+
+    for product in menu:
+        sku = get_product_sku(product['name'], product['id'])
+        remote_product = remote_by_sku.pop(sku, None)
+        if remote_product is None:
+            plan.append(('create', sku, product, None))
+            continue
+
+        if get_local_product_hash(product) != \
+                get_remote_product_hash(remote_product):
+            plan.append(('update', sku, product, remote_product['id']))
+
+        image_url = product['product_image']['url']
+        has_image = remote_product.get('relationships', {}).get('main_image')
+        known_source = image_sources.get(sku)
+        if not has_image or (known_source and known_source != image_url):
+            plan.append(('image', sku, product, remote_product['id']))
+
+    for sku, remote_product in remote_by_sku.items():
+        plan.append(('delete', sku, None, remote_product['id']))
+
+    return plan
+
+
+def plan_entries_sync(pizzeria_addresses, remote_entries):
+    remote_by_alias = {entry.get('alias'): entry for entry in remote_entries}
+    plan = []
+
+    for pizzeria_address in pizzeria_addresses:
+        alias = pizzeria_address['alias']
+        remote_entry = remote_by_alias.pop(alias, None)
+        if remote_entry is None:
+            plan.append(('create', alias, pizzeria_address, None))
+        elif get_local_entry_hash(pizzeria_address) != \
+                get_remote_entry_hash(remote_entry):
+            plan.append(('update', alias, pizzeria_address,
+                         remote_entry['id']))
+
+    for alias, remote_entry in remote_by_alias.items():
+        plan.append(('delete', alias, None, remote_entry['id']))
+
+    return plan
+
+
+def load_image_sources(database):
+    if database is None:
+        return {}
+    return {
+        sku.decode('utf-8'): url.decode('utf-8')
+        for sku, url in database.hgetall(get_key(IMAGE_SOURCES_KEY)).items()
+    }
+
+
+def record_image_source(database, sku, image_url):
+    if database is not None:
+        database.hset(get_key(IMAGE_SOURCES_KEY), sku, image_url)
@@ -0,0 +1,109 @@
+import time
+from collections import deque
+from threading import Lock
+
+from metrics import CIRCUIT_OPEN, CIRCUIT_REJECTED
+
+FAILURE_RATE = 0.5
+MIN_CALLS = 10
+WINDOW = 30
+RESET_TIMEOUT = 30
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_breakers = {}
+_breakers_lock = Lock()
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f'Circuit {name} is open')
+        self.name = name
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_rate=FAILURE_RATE, min_calls=MIN_CALLS,
+                 window=WINDOW, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened_at = 0
+        self._calls = deque()
+        self._failures = 0
+        self._trial_running = False
+        self._lock = Lock()
+        CIRCUIT_OPEN.set_function(lambda: int(self.state != CLOSED),
+                                  breaker=name)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and \
+                    time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+        CIRCUIT_REJECTED.inc(breaker=self.name)
+        raise CircuitOpenError(self.name)
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.close()
+            self.add_call(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.open()
+                return
+            self.add_call(True)
+            if len(self._calls) >= self.min_calls and \
+                    self._failures >= self.failure_rate * len(self._calls):
+                self.open()
+
+    def add_call(self, failed):
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        self._failures += failed
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, expired_failed = self._calls.popleft()
+            self._failures -= expired_failed
+
+    def open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def close(self):
+        self.state = CLOSED
+        self._trial_running = False
+        self._calls.clear()
+        self._failures = 0
+
+    def call(self, function, *args, **kwargs):
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
@@ -0,0 +1,166 @@
+import json
+import math
+from collections import namedtuple
+from threading import Lock
+
+from pizzeria_index import EARTH_RADIUS_KM, haversine_km
+
+ZONES_PATH = 'delivery_zones.json'
+ZONE_CELL_SIZE_DEG = 0.02
+ZONE_MAX_LEVEL = 4
+ZONE_MAX_CELLS = 100000
+DEFAULT_TIERS = [
+    {'max_distance': 0.5, 'price': 0},
+    {'max_distance': 5, 'price': 100},
+    {'max_distance': 20, 'price': 300},
+]
+
+Quote = namedtuple('Quote', ['pizzeria', 'tier'])
+
+_ambiguous = object()
+_zones = None
+_zones_lock = Lock()
+
+
+def load_zones_config(path=ZONES_PATH):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'default': DEFAULT_TIERS}
+
+
+def get_tier(tiers, distance):
+    for tier in tiers:
+        if distance <= tier['max_distance']:
+            return tier
+    return None
+
+
+class DeliveryZones:
+    def __init__(self, pizzeria_index, config, cell_size=ZONE_CELL_SIZE_DEG,
+                 max_level=ZONE_MAX_LEVEL, max_cells=ZONE_MAX_CELLS):
+        self.index = pizzeria_index
+        self.cell_size = cell_size
+        self.max_level = max_level
+        self.max_cells = max_cells
+        self.table = {}
+
+        default_tiers = sorted(config.get('default', DEFAULT_TIERS),
+                               key=lambda tier: tier['max_distance'])
+        city_tiers = config.get('cities', {})
+        outlet_tiers = config.get('outlets', {})
+        self.tiers = []
+        for pizzeria in pizzeria_index.pizzerias:
+            tiers = outlet_tiers.get(pizzeria.alias) or \
+                city_tiers.get(pizzeria.city) or default_tiers
+            self.tiers.append(sorted(tiers,
+                                     key=lambda tier: tier['max_distance']))
+        self.numbers = {id(pizzeria): number for number, pizzeria
+                        in enumerate(pizzeria_index.pizzerias)}
+
+    def get_cell(self, latitude, longitude, level=0):
+        cell_size = self.cell_size / 2 ** level
+        return (level,
+                math.floor(latitude / cell_size),
+                math.floor(longitude / cell_size))
+
+    def get_pizzeria_tiers(self, pizzeria):
+        return self.tiers[self.numbers[id(pizzeria)]]
+
+    def resolve_cell(self, cell):
+        level, row, column = cell
+        cell_size = self.cell_size / 2 ** level
+        south, west = row * cell_size, column * cell_size
+        latitude = south + cell_size / 2
+        longitude = west + cell_size / 2
+        radius = max(
+            haversine_km(latitude, longitude, corner_latitude,
+                         corner_longitude)
+            for corner_latitude in (south, south + cell_size)
+            for corner_longitude in (west, west + cell_size)
+        )
+
+        nearest = self.index.nearest(latitude, longitude, k=2)
+        if not nearest:
+            return _ambiguous
+        pizzeria, distance = nearest[0]
+        if len(nearest) > 1 and nearest[1][1] - radius <= distance + radius:
+            return _ambiguous
+
+        tiers = self.get_pizzeria_tiers(pizzeria)
+        tier = get_tier(tiers, max(0, distance - radius))
+        if tier is not get_tier(tiers, distance + radius):
+            return _ambiguous
+        return Quote(pizzeria, tier)
+
+    def quote(self, latitude, longitude):
+        for level in range(self.max_level + 1):
+            cell = self.get_cell(latitude, longitude, level)
+            quote = self.table.get(cell)
+            if quote is None:
+                quote = self.resolve_cell(cell)
+                # Arbitrary points must not grow the table without bound;
+                # past the cap, cells are resolved but not kept.
+                if len(self.table) < self.max_cells:
+                    self.table[cell] = quote
+            if quote is not _ambiguous:
+                return quote
+
+        nearest = self.index.nearest(latitude, longitude)
+        if not nearest:
+            return Quote(None, None)
+        pizzeria, distance = nearest[0]
+        return Quote(pizzeria,
+                     get_tier(self.get_pizzeria_tiers(pizzeria), distance))
+
+    def quote_many(self, points):
+        return [self.quote(latitude, longitude)
+                for latitude, longitude in points]
+
+    def precompute(self):
+        for pizzeria, tiers in zip(self.index.pizzerias, self.tiers):
+            if tiers:
+                self.precompute_around(pizzeria, tiers[-1]['max_distance'])
+
+    def precompute_around(self, pizzeria, max_distance):
+        latitude_margin = math.degrees(max_distance / EARTH_RADIUS_KM)
+        longitude_margin = latitude_margin / max(
+            math.cos(math.radians(min(abs(pizzeria.latitude)
+                                      + latitude_margin, 90))), 0.01)
+        cell_radius = math.radians(self.cell_size) * EARTH_RADIUS_KM \
+            / math.sqrt(2)
+
+        level, min_row, min_column = self.get_cell(
+            pizzeria.latitude - latitude_margin,
+            pizzeria.longitude - longitude_margin
+        )
+        level, max_row, max_column = self.get_cell(
+            pizzeria.latitude + latitude_margin,
+            pizzeria.longitude + longitude_margin
+        )
+        for row in range(min_row, max_row + 1):
+            latitude = (row + 0.5) * self.cell_size
+            for column in range(min_column, max_column + 1):
+                cell = level, row, column
+                if cell in self.table:
+                    continue
+                longitude = (column + 0.5) * self.cell_size
+                if haversine_km(latitude, longitude, pizzeria.latitude,
+                                pizzeria.longitude) \
+                        > max_distance + cell_radius:
+                    continue
+                self.table[cell] = self.resolve_cell(cell)
+
+
+def get_delivery_zones(pizzeria_index, path=ZONES_PATH):
+    global _zones
+
+    zones = _zones
+    if zones is not None and zones.index is pizzeria_index:
+        return zones
+
+    with _zones_lock:
+        if _zones is None or _zones.index is not pizzeria_index:
+            _zones = DeliveryZones(pizzeria_index, load_zones_config(path))
+    return _zones
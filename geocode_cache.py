@@ -0,0 +1,98 @@
+import hashlib
+import re
+from collections import Counter
+from threading import Event, Lock
+
+from tenants import get_key
+
+POSITIVE_TTL = 30 * 24 * 60 * 60
+NEGATIVE_TTL = 24 * 60 * 60
+KEY_PREFIX = 'geocode:'
+NOT_FOUND = b''
+
+geocode_stats = Counter()
+
+_inflight = {}
+_inflight_lock = Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+def normalize_address(address):
+    address = address.lower().replace('ё', 'е')
+    address = re.sub(r'[^\w\s/-]', ' ', address)
+    return ' '.join(address.split())
+
+
+def get_cache_key(address):
+    normalized = normalize_address(address)
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return get_key(f'{KEY_PREFIX}{digest}')
+
+
+def single_flight(key, function, *args):
+    with _inflight_lock:
+        call = _inflight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _inflight[key] = _Call()
+
+    if not is_leader:
+        geocode_stats['coalesced'] += 1
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = function(*args)
+        return call.result
+    except Exception as err:
+        call.error = err
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+
+
+def get_cached_coordinates(database, fetch_coordinates, apikey, address,
+                           positive_ttl=POSITIVE_TTL,
+                           negative_ttl=NEGATIVE_TTL):
+    key = get_cache_key(address)
+
+    cached = database.get(key)
+    if cached is not None:
+        if cached == NOT_FOUND:
+            geocode_stats['negative_hits'] += 1
+            return None
+        geocode_stats['hits'] += 1
+        latitude, longitude = cached.decode('utf-8').split(',')
+        return float(latitude), float(longitude)
+
+    geocode_stats['misses'] += 1
+    return single_flight(key, fetch_and_store, database, fetch_coordinates,
+                         apikey, address, key, positive_ttl, negative_ttl)
+
+
+def fetch_and_store(database, fetch_coordinates, apikey, address, key,
+                    positive_ttl, negative_ttl):
+    geocode_stats['upstream_calls'] += 1
+    try:
+        coordinates = fetch_coordinates(apikey, address)
+    except Exception:
+        geocode_stats['upstream_errors'] += 1
+        raise
+
+    if coordinates is None:
+        database.set(key, NOT_FOUND, ex=negative_ttl)
+    else:
+        latitude, longitude = coordinates
+        database.set(key, f'{latitude},{longitude}', ex=positive_ttl)
+    return coordinates
+
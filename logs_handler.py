@@ -1,18 +1,149 @@
 import logging
+import os
+import queue
+import time
+from collections import Counter
+from threading import Thread
+
 import telegram
+from telegram.error import RetryAfter
+
+from rate_limiter import TokenBucket
+
+MESSAGE_LIMIT = 4096
+QUEUE_SIZE = 1000
+BATCH_INTERVAL = 2
+SEND_INTERVAL = 3
+DEDUPE_WINDOW = 5 * 60
+CLOSE_TIMEOUT = 5
 
 
 class CustomLogsHandler(logging.Handler):
-    def __init__(self, chat_id, tg_token=None):
+    def __init__(self, chat_id, tg_token=None, queue_size=QUEUE_SIZE,
+                 batch_interval=BATCH_INTERVAL, send_interval=SEND_INTERVAL,
+                 dedupe_window=DEDUPE_WINDOW):
         super().__init__()
         self.chat_id = chat_id
-        self.bot = None
-        self.vk_api = None
         self.bot = telegram.Bot(token=tg_token)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_interval = batch_interval
+        self.dedupe_window = dedupe_window
+        self.send_limit = TokenBucket(1 / send_interval, capacity=1)
+        self.stats = Counter()
+        self._reported_drops = 0
+        self._suppressed = Counter()
+        self._last_sent = {}
+        self.start()
+        os.register_at_fork(after_in_child=self.restart_after_fork)
+
+    def start(self):
+        self._thread = Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def restart_after_fork(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.start()
 
     def emit(self, record):
-        log_entry = self.format(record)
-        self.bot.send_message(
-                chat_id=self.chat_id,
-                text=log_entry
-            )
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats['dropped'] += 1
+
+    def close(self):
+        try:
+            self.queue.put(None, timeout=CLOSE_TIMEOUT)
+        except queue.Full:
+            pass
+        self._thread.join(CLOSE_TIMEOUT)
+        super().close()
+
+    def run(self):
+        running = True
+        while running:
+            records = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while records[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    records.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if records[-1] is None:
+                records.pop()
+                running = False
+
+            for message in self.build_messages(records):
+                self.send(message)
+
+    def get_dedupe_key(self, record):
+        exc_type = record.exc_info[0] if record.exc_info else None
+        return record.name, record.levelno, str(record.msg), exc_type
+
+    def forget_old_keys(self, now):
+        self._last_sent = {
+            key: sent_at for key, sent_at in self._last_sent.items()
+            if now - sent_at < self.dedupe_window
+        }
+
+    def build_messages(self, records):
+        now = time.monotonic()
+        if len(self._last_sent) > QUEUE_SIZE:
+            self.forget_old_keys(now)
+        entries = {}
+        for record in records:
+            key = self.get_dedupe_key(record)
+            if key in entries:
+                entries[key][1] += 1
+                continue
+            if now - self._last_sent.get(key, -self.dedupe_window) < \
+                    self.dedupe_window:
+                self._suppressed[key] += 1
+                continue
+            try:
+                entries[key] = [self.format(record), 1]
+            except Exception:
+                self.stats['failed'] += 1
+                continue
+            self._last_sent[key] = now
+
+        texts = []
+        for key, (text, count) in entries.items():
+            count += self._suppressed.pop(key, 0)
+            if count > 1:
+                text = f'{text}\n(повторилось {count} раз)'
+            texts.append(text[:MESSAGE_LIMIT])
+
+        dropped = self.stats['dropped'] - self._reported_drops
+        if dropped:
+            self._reported_drops += dropped
+            texts.append(f'Потеряно {dropped} записей: очередь логов '
+                         'переполнена')
+
+        return self.join_messages(texts)
+
+    def join_messages(self, texts):
+        messages = []
+        current = ''
+        for text in texts:
+            if current and len(current) + len(text) + 2 > MESSAGE_LIMIT:
+                messages.append(current)
+                current = ''
+            current = f'{current}\n\n{text}' if current else text
+        if current:
+            messages.append(current)
+        return messages
+
+    def send(self, message):
+        self.send_limit.acquire()
+        try:
+            self.bot.send_message(chat_id=self.chat_id, text=message)
+            self.stats['sent'] += 1
+        except RetryAfter as err:
+            time.sleep(err.retry_after)
+            self.send(message)
+        except Exception:
+            self.stats['failed'] += 1
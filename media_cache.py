@@ -0,0 +1,97 @@
+from collections import Counter
+
+from telegram.error import BadRequest
+
+from catalog_model import get_product_image_id
+from moltin_api import get_access_token, get_image_url, iter_products
+from redis_shards import ShardRouter, get_redis_urls
+from tenants import get_key, set_tenant
+
+FILE_IDS_KEY = 'telegram_file_ids'
+
+media_stats = Counter()
+
+_file_ids = {}
+
+
+def get_file_id(database, image_id):
+    file_id = _file_ids.get(image_id)
+    if file_id is None:
+        file_id = database.hget(get_key(FILE_IDS_KEY), image_id)
+        if file_id is not None:
+            file_id = _file_ids[image_id] = file_id.decode('utf-8')
+    return file_id
+
+
+def save_file_id(database, image_id, message):
+    file_id = message.photo[-1].file_id
+    _file_ids[image_id] = file_id
+    database.hset(get_key(FILE_IDS_KEY), image_id, file_id)
+
+
+def forget_file_id(database, image_id):
+    _file_ids.pop(image_id, None)
+    database.hdel(get_key(FILE_IDS_KEY), image_id)
+
+
+def send_product_photo(bot, database, chat_id, image_id, load_image_url,
+                       **kwargs):
+    file_id = get_file_id(database, image_id)
+    if file_id is not None:
+        try:
+            message = bot.send_photo(chat_id=chat_id, photo=file_id,
+                                     **kwargs)
+            media_stats['hits'] += 1
+            return message
+        except BadRequest:
+            forget_file_id(database, image_id)
+
+    media_stats['misses'] += 1
+    message = bot.send_photo(chat_id=chat_id, photo=load_image_url(),
+                             **kwargs)
+    save_file_id(database, image_id, message)
+    return message
+
+
+def warm_media_cache(bot, database, chat_id, moltin_api_token):
+    uploaded = 0
+    for product in iter_products(moltin_api_token):
+        image_id = get_product_image_id(product)
+        if image_id is None or get_file_id(database, image_id):
+            continue
+
+        message = bot.send_photo(
+            chat_id=chat_id,
+            photo=get_image_url(image_id, moltin_api_token),
+            disable_notification=True
+        )
+        save_file_id(database, image_id, message)
+        bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+        uploaded += 1
+    return uploaded
+
+
+def main():
+    import redis
+    from environs import Env
+    from telegram import Bot
+
+    env = Env()
+    env.read_env()
+
+    set_tenant(env.str('TENANT', ''))
+    bot = Bot(env.str('TELEGRAM_TOKEN'))
+    database = ShardRouter.from_urls(get_redis_urls(env),
+                                     redis.Redis).get_tenant_shard()
+    moltin_api_token, expiration_time = get_access_token(
+        env.str('MOLTIN_CLIENT_ID'),
+        env.str('MOLTIN_CLIENT_SECRET')
+    )
+
+    uploaded = warm_media_cache(bot, database, env.str('CHAT_ID'),
+                                moltin_api_token)
+    print(f'Загружено изображений: {uploaded}')
+
+
+if __name__ == '__main__':
+    main()
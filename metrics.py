@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+trace_logger = logging.getLogger('tg_bot.trace')
+
+_registry = []
+_trace = threading.local()
+
+
+def get_label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = get_label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{format_labels(labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = get_label_key(labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0, 0]
+            bucket_counts = series[0]
+            for number, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    bucket_counts[number] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            self.observe(duration, **labels)
+            add_span(self.name, labels, duration)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for key, (bucket_counts, total, count) in sorted(
+                self.values.items()):
+            for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                labels = key + (('le', bucket),)
+                yield f'{self.name}_bucket{format_labels(labels)} ' \
+                      f'{bucket_count}'
+            labels = key + (('le', '+Inf'),)
+            yield f'{self.name}_bucket{format_labels(labels)} {count}'
+            yield f'{self.name}_sum{format_labels(key)} {total}'
+            yield f'{self.name}_count{format_labels(key)} {count}'
+
+
+class Gauge:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.functions = {}
+        _registry.append(self)
+
+    def set_function(self, function, **labels):
+        self.functions[get_label_key(labels)] = function
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, function in sorted(self.functions.items()):
+            yield f'{self.name}{format_labels(labels)} {function()}'
+
+
+HANDLER_LATENCY = Histogram('bot_handler_seconds',
+                            'State handler latency')
+HANDLER_ERRORS = Counter('bot_handler_errors_total',
+                         'State handler exceptions')
+MOLTIN_LATENCY = Histogram('moltin_request_seconds',
+                           'Moltin API request latency')
+MOLTIN_ERRORS = Counter('moltin_request_errors_total',
+                        'Moltin API requests that failed')
+REDIS_LATENCY = Histogram('redis_command_seconds',
+                          'Redis command latency')
+GEOCODER_LATENCY = Histogram('geocoder_request_seconds',
+                             'Yandex geocoder request latency')
+GEOCODER_ERRORS = Counter('geocoder_request_errors_total',
+                          'Yandex geocoder requests that failed')
+TELEGRAM_SEND_WAIT = Histogram('telegram_send_wait_seconds',
+                               'Time Telegram calls waited for a send quota')
+TELEGRAM_SEND_QUEUE = Gauge('telegram_send_queue_depth',
+                            'Telegram calls waiting for a send quota')
+TELEGRAM_RETRIES = Counter('telegram_send_retries_total',
+                           'Telegram calls retried after a 429')
+CIRCUIT_OPEN = Gauge('circuit_breaker_open',
+                     'Whether calls to an upstream are failing fast')
+CIRCUIT_REJECTED = Counter('circuit_breaker_rejected_total',
+                           'Calls rejected by an open circuit breaker')
+CACHE_HIT_RATIO = Gauge('cache_hit_ratio', 'Share of cache lookups served '
+                                           'without an upstream call')
+
+
+def get_hit_ratio(stats, hit_keys=('hits',), miss_keys=('misses',)):
+    hits = sum(stats[key] for key in hit_keys)
+    lookups = hits + sum(stats[key] for key in miss_keys)
+    if not lookups:
+        return 0.0
+    return hits / lookups
+
+
+def register_cache(name, stats, hit_keys=('hits',), miss_keys=('misses',)):
+    CACHE_HIT_RATIO.set_function(
+        lambda: get_hit_ratio(stats, hit_keys, miss_keys), cache=name)
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def add_span(name, labels, duration):
+    spans = getattr(_trace, 'spans', None)
+    if spans is not None:
+        spans.append((name, labels, duration))
+
+
+@contextmanager
+def trace_update(name):
+    _trace.spans = []
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans, _trace.spans = _trace.spans, None
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            total = time.perf_counter() - started_at
+            details = ', '.join(
+                f'{span_name}{format_labels(tuple(labels.items()))}='
+                f'{duration * 1000:.1f}ms'
+                for span_name, labels, duration in spans
+            )
+            trace_logger.debug('%s %.1fms: %s', name, total * 1000, details)
+
+
+class InstrumentedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        with REDIS_LATENCY.time(command=str(args[0]).lower()):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipeline = super().pipeline(transaction, shard_hint)
+        execute = pipeline.execute
+
+        def execute_timed(raise_on_error=True):
+            with REDIS_LATENCY.time(command='pipeline'):
+                return execute(raise_on_error)
+
+        pipeline.execute = execute_timed
+        return pipeline
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -1,296 +1,602 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from slugify import slugify
+from urllib3.util.retry import Retry
+
+from circuit_breaker import get_breaker
+from metrics import MOLTIN_ERRORS, MOLTIN_LATENCY, add_span
+
+MOLTIN_API_URL = os.environ.get('MOLTIN_API_URL', 'https://api.moltin.com')
+DEFAULT_TIMEOUT = (3.05, 10)
+ENDPOINT_TIMEOUTS = {
+    'carts': (3.05, 5),
+    'products': (3.05, 5),
+    'files': (3.05, 5),
+    'flows': (3.05, 10),
+    'oauth': (3.05, 10),
+}
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.3
+DEFAULT_POOL_SIZE = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+DEFAULT_PAGE_SIZE = 100
+PREFETCH_WORKERS = 4
+
+_session = None
+_client = None
+_page_cache = {}
+_prefetch_executor = None
+
+
+class RateLimitRetry(Retry):
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429:
+            return bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def create_session(retries=DEFAULT_RETRIES,
+                   backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                   pool_size=DEFAULT_POOL_SIZE,
+                   retry_methods=IDEMPOTENT_METHODS):
+    retry = RateLimitRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=retry_methods,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
-def create_product(moltin_api_token, product_id, name, description, price):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-    }
-
-    product_slug = slugify(name)
-
-    payload = {
-        'data': {
-            'type': 'product',
-            'name': name,
-            'slug': product_slug,
-            'sku': f'{product_slug}-{product_id}',
-            'description': description,
-            'manage_stock': False,
-            'price': [
-                {
-                    'amount': price*100,
-                    'currency': 'RUB',
-                    'includes_tax': False,
-                },
-            ],
-            'status': 'live',
-            'commodity_type': 'physical',
-        },
-    }
-
-    response = requests.post('https://api.moltin.com/v2/products',
-                             headers=headers,
-                             json=payload)
-    response.raise_for_status()
-    product_id = response.json()['data']['id']
-    return product_id
-
-
-def upload_product_image(moltin_api_token, image_url):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
+def get_session():
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
 
-    files = {
-        'file_location': (None, image_url),
-    }
 
-    response = requests.post('https://api.moltin.com/v2/files',
-                             headers=headers, files=files)
-    response.raise_for_status()
-    image_id = response.json()['data']['id']
-    return image_id
+def get_prefetch_executor():
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(
+            max_workers=PREFETCH_WORKERS,
+            thread_name_prefix='moltin-prefetch'
+        )
+    return _prefetch_executor
 
 
-def relate_image_to_product(moltin_api_token, product_id, name, description,
-                            price, image_url):
+def reset_after_fork():
+    global _session, _client, _prefetch_executor
+    _session = None
+    _client = None
+    _prefetch_executor = None
 
-    product_id = create_product(moltin_api_token, product_id, name,
-                                description, price)
-    image_id = upload_product_image(moltin_api_token, image_url)
 
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
+os.register_at_fork(after_in_child=reset_after_fork)
 
-    payload = {
-        'data': {
-            'type': 'main_image',
-            'id': image_id,
-        },
-    }
-    response = requests.post(
-        f'https://api.moltin.com/v2/products/{product_id}/relationships/main-image',
-        headers=headers,
-        json=payload
-    )
 
-    response.raise_for_status()
+def get_endpoint(path):
+    parts = path.strip('/').split('/')
+    if parts[0] == 'v2' and len(parts) > 1:
+        return parts[1]
+    return parts[0]
 
-    return response.json()
 
+def get_product_sku(name, product_id):
+    return f'{slugify(name)}-{product_id}'
 
-def create_flow(moltin_api_token, name, slug, description):
 
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
-
-    payload = {
-        'data': {
-            'type': 'flow',
-            'name': f'{name}',
-            'slug': f'{slug}',
-            'description': f'{description}',
-            'enabled': True,
+def get_price(price):
+    return [
+        {
+            'amount': price*100,
+            'currency': 'RUB',
+            'includes_tax': False,
         },
-    }
+    ]
+
+
+def get_page_params(page_size, offset):
+    return {'page[limit]': page_size, 'page[offset]': offset}
+
+
+def get_validators(response):
+    validators = {}
+    if response.headers.get('ETag'):
+        validators['If-None-Match'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        validators['If-Modified-Since'] = response.headers['Last-Modified']
+    return validators
+
+
+def has_next_page(page, offset, page_size):
+    if not page['data']:
+        return False
+    total = page.get('meta', {}).get('results', {}).get('total')
+    if total is not None:
+        return offset < total
+    return len(page['data']) >= page_size
+
+
+def get_client(moltin_api_token):
+    global _client
+    if _client is None or _client.token != moltin_api_token:
+        _client = MoltinClient(moltin_api_token, session=get_session(),
+                               page_cache=_page_cache, use_breakers=True)
+    return _client
+
+
+class MoltinClient:
+    def __init__(self, token=None, base_url=MOLTIN_API_URL,
+                 timeout=DEFAULT_TIMEOUT, session=None, rate_limits=None,
+                 page_cache=None, timeouts=None, use_breakers=False):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.timeouts = ENDPOINT_TIMEOUTS if timeouts is None else timeouts
+        self.use_breakers = use_breakers
+        self.session = session or create_session()
+        self.rate_limits = rate_limits or {}
+        self.page_cache = {} if page_cache is None else page_cache
+        self.auth_headers = {'Authorization': f'Bearer {token}'}
+        self.cart_headers = {
+            **self.auth_headers,
+            'X-MOLTIN-CURRENCY': 'RUB',
+        }
+
+    def request(self, method, path, headers=None, **kwargs):
+        if headers is None:
+            headers = self.auth_headers
+        endpoint = get_endpoint(path)
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint,
+                                                       self.timeout))
+        breaker = None
+        if self.use_breakers:
+            breaker = get_breaker(f'moltin:{endpoint}')
+            breaker.before_call()
+        rate_limit = self.rate_limits.get(endpoint)
+        if rate_limit is not None:
+            rate_limit.acquire()
+
+        started_at = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}',
+                                            headers=headers, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            duration = time.perf_counter() - started_at
+            MOLTIN_LATENCY.observe(duration, endpoint=endpoint,
+                                   method=method)
+            add_span(MOLTIN_LATENCY.name,
+                     {'endpoint': endpoint, 'status': status}, duration)
+            if status == 'error' or status >= 400:
+                MOLTIN_ERRORS.inc(endpoint=endpoint, status=status)
+            if breaker is not None:
+                if status == 'error' or status in RETRY_STATUSES:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+    def get_page(self, path, params):
+        key = path, tuple(sorted(params.items()))
+        cached = self.page_cache.get(key)
+        headers = self.auth_headers
+        if cached is not None:
+            headers = {**headers, **cached[0]}
+
+        response = self.request('GET', path, headers=headers, params=params)
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        response.raise_for_status()
+        page = response.json()
+        validators = get_validators(response)
+        if validators:
+            self.page_cache[key] = validators, page
+        return page
+
+    def iter_pages(self, path, page_size=DEFAULT_PAGE_SIZE, prefetch=True):
+        offset = 0
+        page = self.get_page(path, get_page_params(page_size, offset))
+        while True:
+            offset += len(page['data'])
+            if not has_next_page(page, offset, page_size):
+                yield page['data']
+                return
+
+            params = get_page_params(page_size, offset)
+            if not prefetch:
+                yield page['data']
+                page = self.get_page(path, params)
+                continue
+
+            next_page = get_prefetch_executor().submit(self.get_page, path,
+                                                       params)
+            try:
+                yield page['data']
+            except GeneratorExit:
+                next_page.cancel()
+                raise
+            page = next_page.result()
+
+    def iter_items(self, path, page_size=DEFAULT_PAGE_SIZE, prefetch=True):
+        for items in self.iter_pages(path, page_size, prefetch):
+            yield from items
+
+    def get_access_token(self, moltin_client_id, moltin_client_secret):
+        data = {
+            'client_id': moltin_client_id,
+            'client_secret': moltin_client_secret,
+            'grant_type': 'client_credentials'
+        }
 
-    response = requests.post('https://api.moltin.com/v2/flows',
-                             headers=headers, json=payload)
+        response = self.request('POST', '/oauth/access_token',
+                                headers={}, data=data)
+        response.raise_for_status()
+        auth_response = response.json()
+        moltin_api_token = auth_response['access_token']
+        expire_time = auth_response['expires_in']
+
+        return moltin_api_token, expire_time
+
+    def create_product(self, product_id, name, description, price):
+        product_slug = slugify(name)
+
+        payload = {
+            'data': {
+                'type': 'product',
+                'name': name,
+                'slug': product_slug,
+                'sku': get_product_sku(name, product_id),
+                'description': description,
+                'manage_stock': False,
+                'price': get_price(price),
+                'status': 'live',
+                'commodity_type': 'physical',
+            },
+        }
 
-    response_data = response.json()['data']
+        response = self.request('POST', '/v2/products', json=payload)
+        response.raise_for_status()
+        product_id = response.json()['data']['id']
+        return product_id
+
+    def update_product(self, product_id, name, description, price):
+        payload = {
+            'data': {
+                'type': 'product',
+                'id': product_id,
+                'name': name,
+                'description': description,
+                'price': get_price(price),
+            },
+        }
 
-    flow_id, flow_slug = response_data['id'], response_data['slug']
+        response = self.request('PUT', f'/v2/products/{product_id}',
+                                json=payload)
+        response.raise_for_status()
+        return response.json()['data']
 
-    return flow_id, flow_slug
+    def delete_product(self, product_id):
+        response = self.request('DELETE', f'/v2/products/{product_id}')
+        response.raise_for_status()
 
+    def upload_product_image(self, image_url):
+        files = {
+            'file_location': (None, image_url),
+        }
 
-def add_field_to_flow(moltin_api_token, name, slug, field_type, description,
-                      flow_id, required=True, enabled=True):
+        response = self.request('POST', '/v2/files', files=files)
+        response.raise_for_status()
+        image_id = response.json()['data']['id']
+        return image_id
+
+    def relate_image_to_product(self, product_id, name, description, price,
+                                image_url):
+        product_id = self.create_product(product_id, name, description,
+                                         price)
+        image_id = self.upload_product_image(image_url)
+        return self.set_main_image(product_id, image_id)
+
+    def set_main_image(self, product_id, image_id):
+        payload = {
+            'data': {
+                'type': 'main_image',
+                'id': image_id,
+            },
+        }
+        response = self.request(
+            'POST',
+            f'/v2/products/{product_id}/relationships/main-image',
+            json=payload
+        )
+        response.raise_for_status()
+
+        return response.json()
+
+    def create_flow(self, name, slug, description):
+        payload = {
+            'data': {
+                'type': 'flow',
+                'name': f'{name}',
+                'slug': f'{slug}',
+                'description': f'{description}',
+                'enabled': True,
+            },
+        }
 
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
-
-    payload = {
-        'data': {
-            'type': 'field',
-            'name': f'{name}',
-            'slug': f'{slug}',
-            'field_type': f'{field_type}',
-            'description': f'{description}',
-            'required': required,
-            'enabled': enabled,
-            'relationships': {
-                'flow': {
-                    'data': {
-                        'type': 'flow',
-                        'id': f'{flow_id}',
+        response = self.request('POST', '/v2/flows', json=payload)
+
+        response_data = response.json()['data']
+
+        flow_id, flow_slug = response_data['id'], response_data['slug']
+
+        return flow_id, flow_slug
+
+    def add_field_to_flow(self, name, slug, field_type, description, flow_id,
+                          required=True, enabled=True):
+        payload = {
+            'data': {
+                'type': 'field',
+                'name': f'{name}',
+                'slug': f'{slug}',
+                'field_type': f'{field_type}',
+                'description': f'{description}',
+                'required': required,
+                'enabled': enabled,
+                'relationships': {
+                    'flow': {
+                        'data': {
+                            'type': 'flow',
+                            'id': f'{flow_id}',
+                        },
                     },
                 },
             },
-        },
-    }
-
-    response = requests.post('https://api.moltin.com/v2/fields',
-                             headers=headers, json=payload)
-    return response.json()
+        }
 
+        response = self.request('POST', '/v2/fields', json=payload)
+        return response.json()
+
+    def create_entry_to_flow(self, flow_slug, address, alias, longitude,
+                             latitude):
+        payload = {
+            'data': {
+                'type': 'entry',
+                'address': address,
+                'alias': alias,
+                'longitude': longitude,
+                'latitude': latitude,
+            }
+        }
 
-def create_entry_to_flow(moltin_api_token, flow_slug, address, alias, longitude, latitude):
+        response = self.request('POST', f'/v2/flows/{flow_slug}/entries',
+                                json=payload)
+
+        return response.json()
+
+    def update_flow_entry(self, flow_slug, entry_id, address, alias,
+                          longitude, latitude):
+        payload = {
+            'data': {
+                'type': 'entry',
+                'id': entry_id,
+                'address': address,
+                'alias': alias,
+                'longitude': longitude,
+                'latitude': latitude,
+            }
+        }
 
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-    }
-
-    payload = {
-        'data': {
-            'type': 'entry',
-            'address': address,
-            'alias': alias,
-            'longitude': longitude,
-            'latitude': latitude,
+        response = self.request('PUT',
+                                f'/v2/flows/{flow_slug}/entries/{entry_id}',
+                                json=payload)
+        response.raise_for_status()
+        return response.json()['data']
+
+    def delete_flow_entry(self, flow_slug, entry_id):
+        response = self.request('DELETE',
+                                f'/v2/flows/{flow_slug}/entries/{entry_id}')
+        response.raise_for_status()
+
+    def add_product_to_cart(self, cart_id, product_id, with_meta=False):
+        payload = {"data": {'id': product_id,
+                            'type': 'cart_item',
+                            'quantity': 1,
+                            }
+                   }
+
+        response = self.request('POST', f'/v2/carts/{cart_id}/items',
+                                headers=self.cart_headers,
+                                json=payload)
+        response.raise_for_status()
+        if with_meta:
+            return response.json()
+        return response.json()['data']
+
+    def get_cart(self, chat_id):
+        response = self.request('GET', f'/v2/carts/{chat_id}/items')
+        response.raise_for_status()
+        return response.json()
+
+    def iter_products(self, page_size=DEFAULT_PAGE_SIZE, prefetch=True):
+        return self.iter_items('/v2/products/', page_size, prefetch)
+
+    def get_products(self, page_size=DEFAULT_PAGE_SIZE):
+        return list(self.iter_products(page_size))
+
+    def get_products_page(self, offset, limit=DEFAULT_PAGE_SIZE):
+        page = self.get_page('/v2/products/', get_page_params(limit, offset))
+        total = page.get('meta', {}).get('results', {}).get('total')
+        return page['data'], total
+
+    def get_product(self, product_id):
+        response = self.request('GET', f'/v2/products/{product_id}')
+        response.raise_for_status()
+        return response.json()['data']
+
+    def get_image_url(self, image_id):
+        response = self.request('GET', f'/v2/files/{image_id}')
+        response.raise_for_status()
+        return response.json()['data']['link']['href']
+
+    def remove_cart_item(self, cart_id, product_id, with_meta=False):
+        response = self.request('DELETE',
+                                f'/v2/carts/{cart_id}/items/{product_id}')
+        response.raise_for_status()
+        if with_meta:
+            return response.json()
+        return response.json()['data']
+
+    def delete_cart(self, cart_id):
+        response = self.request('DELETE', f'/v2/carts/{cart_id}')
+        response.raise_for_status()
+
+    def create_customer(self, email, name='some name'):
+        payload = {"data": {'type': 'customer',
+                            'name': name,
+                            "email": email,
+                            "password": "mysecretpassword"
+                            }
+                   }
+
+        response = self.request('POST', '/v2/customers', json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def find_customer(self, email):
+        response = self.request('GET', '/v2/customers',
+                                params={'filter': f'eq(email,{email})'})
+        response.raise_for_status()
+        customers = response.json()['data']
+        return customers[0] if customers else None
+
+    def checkout_cart(self, cart_id, customer_id, address):
+        payload = {
+            'data': {
+                'customer': {'id': customer_id},
+                'billing_address': address,
+                'shipping_address': address,
+            },
         }
-    }
 
-    response = requests.post(f'https://api.moltin.com/v2/flows/{flow_slug}/entries',
-                             headers=headers,
-                             json=payload)
+        response = self.request('POST', f'/v2/carts/{cart_id}/checkout',
+                                headers=self.cart_headers, json=payload)
+        response.raise_for_status()
+        return response.json()['data']
 
-    return response.json()
+    def iter_flow_entries(self, flow_slug, page_size=DEFAULT_PAGE_SIZE,
+                          prefetch=True):
+        return self.iter_items(f'/v2/flows/{flow_slug}/entries/', page_size,
+                               prefetch)
 
+    def get_flow_entries(self, flow_slug, page_size=DEFAULT_PAGE_SIZE):
+        return list(self.iter_flow_entries(flow_slug, page_size))
 
-def add_product_to_cart(cart_id, product_id, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-        'X-MOLTIN-CURRENCY': 'RUB',
-    }
+    def get_all_restaurants(self, flow_slug='pizzeria'):
+        return self.get_flow_entries(flow_slug)
 
-    payload = {"data": {'id': product_id,
-                        'type': 'cart_item',
-                        'quantity': 1,
-                        }
-               }
 
-    response = requests.post(f'https://api.moltin.com/v2/carts/{cart_id}/items',
-                             headers=headers,
-                             json=payload)
-    response.raise_for_status()
-    return response.json()['data']
+def create_product(moltin_api_token, product_id, name, description, price):
+    return get_client(moltin_api_token).create_product(
+        product_id, name, description, price)
 
 
-def get_cart(chat_id, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
+def upload_product_image(moltin_api_token, image_url):
+    return get_client(moltin_api_token).upload_product_image(image_url)
 
-    response = requests.get(
-        f'https://api.moltin.com/v2/carts/{chat_id}/items',
-        headers=headers)
-    response.raise_for_status()
-    return response.json()
 
+def relate_image_to_product(moltin_api_token, product_id, name, description,
+                            price, image_url):
+    return get_client(moltin_api_token).relate_image_to_product(
+        product_id, name, description, price, image_url)
 
-def get_products(moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-    }
 
-    response = requests.get('https://api.moltin.com/v2/products/',
-                            headers=headers)
-    response.raise_for_status()
-    return response.json()['data']
+def create_flow(moltin_api_token, name, slug, description):
+    return get_client(moltin_api_token).create_flow(name, slug, description)
 
 
-def get_product(product_id, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
+def add_field_to_flow(moltin_api_token, name, slug, field_type, description,
+                      flow_id, required=True, enabled=True):
+    return get_client(moltin_api_token).add_field_to_flow(
+        name, slug, field_type, description, flow_id, required, enabled)
 
-    response = requests.get(f'https://api.moltin.com/v2/products/{product_id}',
-                            headers=headers)
-    response.raise_for_status()
-    return response.json()['data']
 
+def create_entry_to_flow(moltin_api_token, flow_slug, address, alias, longitude, latitude):
+    return get_client(moltin_api_token).create_entry_to_flow(
+        flow_slug, address, alias, longitude, latitude)
 
-def get_image_url(image_id, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
 
-    response = requests.get(f'https://api.moltin.com/v2/files/{image_id}',
-                            headers=headers)
-    response.raise_for_status()
-    return response.json()['data']['link']['href']
+def add_product_to_cart(cart_id, product_id, moltin_api_token,
+                        with_meta=False):
+    return get_client(moltin_api_token).add_product_to_cart(
+        cart_id, product_id, with_meta)
 
 
-def remove_cart_item(cart_id, product_id, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-    }
+def get_cart(chat_id, moltin_api_token):
+    return get_client(moltin_api_token).get_cart(chat_id)
 
-    response = requests.delete(
-        f'https://api.moltin.com/v2/carts/{cart_id}/items/{product_id}',
-        headers=headers)
-    response.raise_for_status()
-    return response.json()['data']
 
+def iter_products(moltin_api_token, page_size=DEFAULT_PAGE_SIZE):
+    return get_client(moltin_api_token).iter_products(page_size)
 
-def create_customer(email, moltin_api_token):
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-    }
 
-    payload = {"data": {'type': 'customer',
-                        'name': 'some name',
-                        "email": email,
-                        "password": "mysecretpassword"
-                        }
-               }
+def get_products(moltin_api_token):
+    return get_client(moltin_api_token).get_products()
 
-    response = requests.post('https://api.moltin.com/v2/customers',
-                             headers=headers,
-                             json=payload)
-    response.raise_for_status()
-    return response.json()
 
+def get_products_page(offset, limit, moltin_api_token):
+    return get_client(moltin_api_token).get_products_page(offset, limit)
 
-def get_access_token(moltin_client_id,
-                     moltin_client_secret):
 
-    data = {
-        'client_id': moltin_client_id,
-        'client_secret': moltin_client_secret,
-        'grant_type': 'client_credentials'
-    }
+def get_product(product_id, moltin_api_token):
+    return get_client(moltin_api_token).get_product(product_id)
+
+
+def get_image_url(image_id, moltin_api_token):
+    return get_client(moltin_api_token).get_image_url(image_id)
+
 
-    response = requests.post('https://api.moltin.com/oauth/access_token',
-                             data=data)
-    response.raise_for_status()
-    auth_response = response.json()
-    moltin_api_token = auth_response['access_token']
-    expire_time = auth_response['expires_in']
+def remove_cart_item(cart_id, product_id, moltin_api_token, with_meta=False):
+    return get_client(moltin_api_token).remove_cart_item(cart_id, product_id,
+                                                         with_meta)
 
-    return moltin_api_token, expire_time
 
+def delete_cart(cart_id, moltin_api_token):
+    return get_client(moltin_api_token).delete_cart(cart_id)
 
-def get_all_restaurants(moltin_api_token):
 
-    headers = {
-        'Authorization': f'Bearer {moltin_api_token}',
-        'Content-Type': 'application/json',
-    }
+def create_customer(email, moltin_api_token, name='some name'):
+    return get_client(moltin_api_token).create_customer(email, name)
 
-    response = requests.get('https://api.moltin.com/v2/flows/pizzeria/entries/',
-                            headers=headers)
-    response.raise_for_status()
-    return response.json()['data']
+
+def find_customer(email, moltin_api_token):
+    return get_client(moltin_api_token).find_customer(email)
+
+
+def checkout_cart(cart_id, customer_id, address, moltin_api_token):
+    return get_client(moltin_api_token).checkout_cart(cart_id, customer_id,
+                                                      address)
+
+
+def get_access_token(moltin_client_id,
+                     moltin_client_secret):
+    client = MoltinClient(session=get_session())
+    return client.get_access_token(moltin_client_id, moltin_client_secret)
 
 
+def get_all_restaurants(moltin_api_token, flow_slug='pizzeria'):
+    return get_client(moltin_api_token).get_all_restaurants(flow_slug)
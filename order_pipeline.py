@@ -0,0 +1,302 @@
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+
+import redis
+import requests
+
+from cart_mirror import CART_GENERATION_TTL, forget_cart
+from circuit_breaker import CircuitOpenError
+from moltin_api import checkout_cart, create_customer, delete_cart, \
+    find_customer
+from redis_shards import ShardRouter, get_redis_urls
+from tenants import get_cart_reference, get_key, set_tenant
+
+ORDERS_STREAM = 'orders'
+FAILED_STREAM = 'orders:failed'
+GROUP_NAME = 'order-writers'
+CUSTOMERS_KEY = 'moltin_customers'
+CHECKED_OUT_KEY = 'checked_out:{}'
+CHECKED_OUT_TTL = CART_GENERATION_TTL
+CUSTOMER_EMAIL = 'telegram-{}@pizzeria-bot.local'
+STREAM_MAXLEN = 100000
+BATCH_SIZE = 50
+READ_BLOCK_MS = 5000
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+logger = logging.getLogger('tg_logger')
+
+order_stats = Counter()
+
+
+def get_customer_email(chat_id):
+    return CUSTOMER_EMAIL.format(chat_id)
+
+
+def get_address(event):
+    pizzeria = event.get('pizzeria') or {}
+    return {
+        'first_name': event['customer']['name'] or 'Telegram',
+        'last_name': str(event['chat_id']),
+        'line_1': event.get('address') or
+        '{}, {}'.format(*event['position']),
+        'city': pizzeria.get('address', '').split(',')[0].strip(),
+        'postcode': '000000',
+        'county': pizzeria.get('alias', ''),
+        'country': 'RU',
+    }
+
+
+def get_checked_out_key(chat_id):
+    return get_key(CHECKED_OUT_KEY.format(get_cart_reference(chat_id)))
+
+
+def get_cart_fingerprint(event):
+    items = sorted(f'{item["id"]}:{item["quantity"]}'
+                   for item in event['cart']['data'])
+    checkout = f'{event.get("cart_generation", 0)}#{"|".join(items)}'
+    return hashlib.sha1(checkout.encode('utf-8')).hexdigest()
+
+
+def enqueue_checkout(database, chat_id, customer_name, cart, position,
+                     pizzeria, delivery_tier, address=None,
+                     cart_generation=0):
+    event = {
+        'chat_id': chat_id,
+        'created_at': time.time(),
+        'customer': {'name': customer_name},
+        'cart': cart,
+        'cart_generation': cart_generation,
+        'position': position,
+        'address': address,
+        'pizzeria': pizzeria and {
+            'alias': pizzeria.alias,
+            'address': pizzeria.address,
+        },
+        'delivery_price': delivery_tier and delivery_tier['price'],
+    }
+    return database.xadd(get_key(ORDERS_STREAM),
+                         {'event': json.dumps(event, ensure_ascii=False)},
+                         maxlen=STREAM_MAXLEN, approximate=True)
+
+
+def create_group(database):
+    try:
+        database.xgroup_create(get_key(ORDERS_STREAM), GROUP_NAME, id='0',
+                               mkstream=True)
+    except redis.ResponseError as err:
+        if 'BUSYGROUP' not in str(err):
+            raise
+
+
+def coalesce_events(entries):
+    latest = {}
+    malformed = []
+    for entry_id, fields in entries:
+        try:
+            event = json.loads(fields[b'event'])
+            latest[event['chat_id']] = entry_id, event
+        except (KeyError, TypeError, ValueError):
+            malformed.append(fields)
+    return latest, malformed
+
+
+def is_retryable(err):
+    if isinstance(err, requests.HTTPError):
+        status = err.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(err, (requests.ConnectionError, requests.Timeout,
+                            redis.ConnectionError, redis.TimeoutError,
+                            CircuitOpenError))
+
+
+def get_customer_id(chat_id, event, moltin_api_token):
+    email = get_customer_email(chat_id)
+    try:
+        return create_customer(email, moltin_api_token,
+                               name=event['customer']['name'] or email
+                               )['data']['id']
+    except requests.HTTPError as err:
+        if err.response.status_code != 409:
+            raise
+
+    customer = find_customer(email, moltin_api_token)
+    if customer is None:
+        raise LookupError(f'Customer {email} exists but was not found')
+    return customer['id']
+
+
+def get_customer_ids(database, moltin_api_token, events):
+    chat_ids = list(events)
+    if not chat_ids:
+        return {}, {}
+    cached_ids = database.hmget(get_key(CUSTOMERS_KEY), chat_ids)
+    customer_ids = {}
+    new_ids = {}
+    failed = {}
+    for chat_id, customer_id in zip(chat_ids, cached_ids):
+        if customer_id is not None:
+            customer_ids[chat_id] = customer_id.decode('utf-8')
+            continue
+        try:
+            customer_ids[chat_id] = new_ids[chat_id] = get_customer_id(
+                chat_id, events[chat_id], moltin_api_token)
+        except Exception as err:
+            failed[chat_id] = err
+
+    if new_ids:
+        database.hset(get_key(CUSTOMERS_KEY), mapping=new_ids)
+    return customer_ids, failed
+
+
+def clear_cart(database, chat_id, moltin_api_token):
+    try:
+        delete_cart(get_cart_reference(chat_id), moltin_api_token)
+    except requests.RequestException as err:
+        logger.warning('Cart of chat %s was not deleted: %s', chat_id, err)
+    forget_cart(database, chat_id)
+
+
+def write_orders(database, moltin_api_token, events, get_chat_database=None):
+    get_chat_database = get_chat_database or (lambda _: database)
+    chat_ids = list(events)
+    checked_out = database.mget([get_checked_out_key(chat_id)
+                                 for chat_id in chat_ids])
+    failed = {}
+    fingerprints = {}
+    for chat_id, checked_out_fingerprint in zip(chat_ids, checked_out):
+        try:
+            fingerprint = get_cart_fingerprint(events[chat_id])
+        except (KeyError, TypeError) as err:
+            failed[chat_id] = err
+            continue
+        if checked_out_fingerprint == fingerprint.encode('utf-8'):
+            order_stats['duplicates'] += 1
+            continue
+        fingerprints[chat_id] = fingerprint
+
+    customer_ids, customer_errors = get_customer_ids(
+        database, moltin_api_token,
+        {chat_id: events[chat_id] for chat_id in fingerprints}
+    )
+    failed.update(customer_errors)
+    for chat_id, customer_id in customer_ids.items():
+        try:
+            checkout_cart(get_cart_reference(chat_id), customer_id,
+                          get_address(events[chat_id]), moltin_api_token)
+        except Exception as err:
+            failed[chat_id] = err
+            continue
+        order_stats['orders'] += 1
+        try:
+            database.set(get_checked_out_key(chat_id), fingerprints[chat_id],
+                         ex=CHECKED_OUT_TTL)
+            clear_cart(get_chat_database(chat_id), chat_id, moltin_api_token)
+        except redis.RedisError:
+            logger.exception('Order for chat %s was written, but its cart '
+                             'was not cleared', chat_id)
+    return failed
+
+
+def process_batch(database, get_token, entries, max_attempts=MAX_ATTEMPTS,
+                  retry_delay=RETRY_DELAY, get_chat_database=None):
+    latest, malformed = coalesce_events(entries)
+    order_stats['events'] += len(entries)
+    order_stats['coalesced'] += len(entries) - len(latest) - len(malformed)
+
+    events = {chat_id: event for chat_id, (_, event) in latest.items()}
+    pending = events
+    failed = {}
+    for attempt in range(1, max_attempts + 1):
+        try:
+            errors = write_orders(database, get_token(), pending,
+                                  get_chat_database)
+        except Exception as err:
+            errors = {chat_id: err for chat_id in pending}
+
+        pending = {}
+        for chat_id, err in errors.items():
+            if attempt < max_attempts and is_retryable(err):
+                pending[chat_id] = events[chat_id]
+            else:
+                failed[chat_id] = err
+        if not pending:
+            break
+        order_stats['retries'] += len(pending)
+        time.sleep(retry_delay * 2 ** (attempt - 1))
+
+    pipeline = database.pipeline()
+    for chat_id, err in failed.items():
+        logger.error('Order for chat %s was not written: %s', chat_id, err)
+        pipeline.xadd(get_key(FAILED_STREAM),
+                      {'event': json.dumps(events[chat_id],
+                                           ensure_ascii=False)},
+                      maxlen=STREAM_MAXLEN, approximate=True)
+    for fields in malformed:
+        logger.error('Malformed order event: %s', fields)
+        pipeline.xadd(get_key(FAILED_STREAM), fields,
+                      maxlen=STREAM_MAXLEN, approximate=True)
+    order_stats['failed'] += len(failed) + len(malformed)
+    pipeline.xack(get_key(ORDERS_STREAM), GROUP_NAME,
+                  *[entry_id for entry_id, _ in entries])
+    pipeline.execute()
+
+
+def run_order_consumer(database, get_token, consumer='writer-0',
+                       batch_size=BATCH_SIZE, get_chat_database=None):
+    create_group(database)
+    last_id = '0'
+    failures = 0
+    while True:
+        try:
+            response = database.xreadgroup(GROUP_NAME, consumer,
+                                           {get_key(ORDERS_STREAM): last_id},
+                                           count=batch_size,
+                                           block=READ_BLOCK_MS)
+            entries = response[0][1] if response else []
+            if not entries:
+                last_id = '>'
+                continue
+            process_batch(database, get_token, entries,
+                          get_chat_database=get_chat_database)
+        except redis.RedisError:
+            failures += 1
+            delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            logger.exception('Order writer %s lost redis, retrying in %s s',
+                             consumer, delay)
+            time.sleep(delay)
+            # A batch that was not acked is still pending for this
+            # consumer, so start over from it.
+            last_id = '0'
+            continue
+        failures = 0
+
+
+def main():
+    from environs import Env
+
+    from token_manager import MoltinTokenManager
+
+    env = Env()
+    env.read_env()
+
+    logging.basicConfig()
+    set_tenant(env.str('TENANT', ''))
+    shards = ShardRouter.from_urls(get_redis_urls(env), redis.Redis)
+    database = shards.get_tenant_shard()
+    token_manager = MoltinTokenManager(env.str('MOLTIN_CLIENT_ID'),
+                                       env.str('MOLTIN_CLIENT_SECRET'),
+                                       database)
+    token_manager.start()
+    run_order_consumer(database, token_manager.get_token,
+                       consumer=env.str('ORDER_CONSUMER', 'writer-0'),
+                       batch_size=env.int('ORDER_BATCH_SIZE', BATCH_SIZE),
+                       get_chat_database=shards.get_chat_shard)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,234 @@
+import argparse
 import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from environs import Env
+from catalog_cache import invalidate_catalog
+from catalog_sync import plan_products_sync, plan_entries_sync, \
+    load_image_sources, record_image_source
+from moltin_api import MoltinClient, create_session, get_access_token, \
+    get_product_sku, create_flow, add_field_to_flow
+from rate_limiter import TokenBucket
+from redis_shards import ShardRouter, get_redis_urls
+from tenants import get_tenant, set_tenant
 
-from moltin_api import get_access_token, \
-    relate_image_to_product, \
-    create_flow, add_field_to_flow, create_entry_to_flow, get_products, \
-    get_cart
+IMPORT_WORKERS = 8
+IMPORT_RETRIES = 5
+IMPORT_BACKOFF_FACTOR = 1
+IMPORT_RATE_LIMITS = {
+    'products': 10,
+    'files': 5,
+    'flows': 10,
+}
 
 
-def add_products_to_store(moltin_api_token):
+def create_import_client(moltin_api_token, workers=IMPORT_WORKERS):
+    session = create_session(retries=IMPORT_RETRIES,
+                             backoff_factor=IMPORT_BACKOFF_FACTOR,
+                             pool_size=workers)
+    rate_limits = {
+        endpoint: TokenBucket(rate)
+        for endpoint, rate in IMPORT_RATE_LIMITS.items()
+    }
+    return MoltinClient(moltin_api_token, session=session,
+                        rate_limits=rate_limits)
 
-    with open("menu.json", "r") as file:
+
+def run_import(items, import_item, workers=IMPORT_WORKERS):
+    report = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(import_item, item): key
+            for key, item in items
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                report[key] = future.result()
+            except Exception as err:
+                report[key] = f'failed: {err}'
+    return report
+
+
+def print_report(report):
+    for key, status in sorted(report.items()):
+        print(f'{key}: {status}')
+
+    totals = Counter(status.split(':')[0] for status in report.values())
+    if totals:
+        print(', '.join(f'{status}: {count}'
+                        for status, count in sorted(totals.items())))
+
+
+def add_products_to_store(moltin_api_token, database=None,
+                          workers=IMPORT_WORKERS):
+
+    with open(get_tenant().menu_path, "r") as file:
       menu_json = file.read()
 
     menu = json.loads(menu_json)
 
-    for product in menu:
-        product_id = product['id']
-        name = product['name']
-        description = product['description']
-        price = product['price']
+    client = create_import_client(moltin_api_token, workers)
+    existing_products = {
+        product['sku']: product for product in client.iter_products()
+    }
+
+    def import_product(product):
+        sku = get_product_sku(product['name'], product['id'])
+        existing_product = existing_products.get(sku)
+        if existing_product:
+            relationships = existing_product.get('relationships', {})
+            if relationships.get('main_image'):
+                return 'skipped'
+            product_id = existing_product['id']
+        else:
+            product_id = client.create_product(product['id'],
+                                               product['name'],
+                                               product['description'],
+                                               product['price'])
+
         image_url = product['product_image']['url']
+        image_id = client.upload_product_image(image_url)
+        client.set_main_image(product_id, image_id)
+        record_image_source(database, sku, image_url)
+        return 'created'
 
-        relate_image_to_product(moltin_api_token,
-                                product_id,
-                                name,
-                                description,
-                                price,
-                                image_url)
+    report = run_import(
+        ((get_product_sku(product['name'], product['id']), product)
+         for product in menu),
+        import_product,
+        workers
+    )
 
+    invalidate_catalog(database)
+    return report
 
-def add_entries_to_flow(moltin_api_token, flow_slug):
 
-    with open("address.json", "r") as file:
+def add_entries_to_flow(moltin_api_token, flow_slug, workers=IMPORT_WORKERS):
+
+    with open(get_tenant().address_path, "r") as file:
       pizzeria_addresses_json = file.read()
 
     pizzeria_addresses = json.loads(pizzeria_addresses_json)
 
-    for pizzeria_address in pizzeria_addresses:
-        address = pizzeria_address['address']['full']
+    client = create_import_client(moltin_api_token, workers)
+    existing_aliases = {
+        entry.get('alias') for entry in client.iter_flow_entries(flow_slug)
+    }
+
+    def import_entry(pizzeria_address):
         alias = pizzeria_address['alias']
-        longitude = pizzeria_address['coordinates']['lon']
-        latitude = pizzeria_address['coordinates']['lat']
+        if alias in existing_aliases:
+            return 'skipped'
+
+        response = client.create_entry_to_flow(
+            flow_slug,
+            pizzeria_address['address']['full'],
+            alias,
+            pizzeria_address['coordinates']['lon'],
+            pizzeria_address['coordinates']['lat']
+        )
+        if 'errors' in response:
+            raise RuntimeError(response['errors'])
+        return 'created'
+
+    return run_import(
+        ((pizzeria_address['alias'], pizzeria_address)
+         for pizzeria_address in pizzeria_addresses),
+        import_entry,
+        workers
+    )
+
+
+def print_plan(plan):
+    for action, key, local_item, remote_id in plan:
+        print(f'{action:<8}{key}')
+
+    totals = Counter(action for action, *_ in plan)
+    print(', '.join(f'{action}: {count}'
+                    for action, count in sorted(totals.items()))
+          or 'nothing to sync')
+
 
-        create_entry_to_flow(moltin_api_token, flow_slug, address, alias,
-                             longitude, latitude)
+def sync_products(moltin_api_token, database=None, dry_run=False,
+                  workers=IMPORT_WORKERS):
 
+    with open(get_tenant().menu_path, "r") as file:
+      menu = json.load(file)
 
-def create_flow_and_fields(moltin_api_token):
-    flow_id, flow_slug = create_flow(moltin_api_token, 'Pizzeria', 'pizzeria', 'Good pizza')
+    client = create_import_client(moltin_api_token, workers)
+    plan = plan_products_sync(menu, client.get_products(),
+                              load_image_sources(database))
+    if dry_run:
+        print_plan(plan)
+        return {}
+
+    def apply_action(step):
+        action, sku, product, product_id = step
+        if action == 'delete':
+            client.delete_product(product_id)
+            return 'deleted'
+        if action == 'update':
+            client.update_product(product_id, product['name'],
+                                  product['description'], product['price'])
+            return 'updated'
+
+        if action == 'create':
+            product_id = client.create_product(product['id'],
+                                               product['name'],
+                                               product['description'],
+                                               product['price'])
+        image_url = product['product_image']['url']
+        image_id = client.upload_product_image(image_url)
+        client.set_main_image(product_id, image_id)
+        record_image_source(database, sku, image_url)
+        return 'created' if action == 'create' else 'image updated'
+
+    report = run_import(((f'{step[0]} {step[1]}', step) for step in plan),
+                        apply_action, workers)
+    if plan:
+        invalidate_catalog(database)
+    return report
+
+
+def sync_entries(moltin_api_token, flow_slug, dry_run=False,
+                 workers=IMPORT_WORKERS):
+
+    with open(get_tenant().address_path, "r") as file:
+      pizzeria_addresses = json.load(file)
+
+    client = create_import_client(moltin_api_token, workers)
+    plan = plan_entries_sync(pizzeria_addresses,
+                             client.get_flow_entries(flow_slug))
+    if dry_run:
+        print_plan(plan)
+        return {}
+
+    def apply_action(step):
+        action, alias, pizzeria_address, entry_id = step
+        if action == 'delete':
+            client.delete_flow_entry(flow_slug, entry_id)
+            return 'deleted'
+
+        fields = (pizzeria_address['address']['full'],
+                  alias,
+                  pizzeria_address['coordinates']['lon'],
+                  pizzeria_address['coordinates']['lat'])
+        if action == 'update':
+            client.update_flow_entry(flow_slug, entry_id, *fields)
+            return 'updated'
+
+        response = client.create_entry_to_flow(flow_slug, *fields)
+        if 'errors' in response:
+            raise RuntimeError(response['errors'])
+        return 'created'
+
+    return run_import(((f'{step[0]} {step[1]}', step) for step in plan),
+                      apply_action, workers)
+
+
+def create_flow_and_fields(moltin_api_token, flow_slug):
+    flow_id, flow_slug = create_flow(moltin_api_token, 'Pizzeria', flow_slug, 'Good pizza')
     add_field_to_flow(moltin_api_token, 'Address',
                       'address',
                       'string',
@@ -74,18 +254,48 @@ def create_flow_and_fields(moltin_api_token):
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Загрузка меню и адресов пиццерий в Moltin')
+    parser.add_argument('command', choices=['products', 'flow', 'pizzerias',
+                                            'sync-products', 'sync-pizzerias'])
+    parser.add_argument('--tenant', help='по умолчанию берётся из TENANT')
+    parser.add_argument('--flow-slug',
+                        help='по умолчанию pizzeria или pizzeria-<tenant>')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='только показать план синхронизации')
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+
+    import redis
+    from environs import Env
+
     env = Env()
     env.read_env()
 
+    tenant = set_tenant(args.tenant or env.str('TENANT', ''))
+    flow_slug = args.flow_slug or tenant.flow_slug
     moltin_client_id = env.str('MOLTIN_CLIENT_ID')
     moltin_client_secret = env.str('MOLTIN_CLIENT_SECRET')
+    database = ShardRouter.from_urls(get_redis_urls(env),
+                                     redis.Redis).get_tenant_shard()
 
     moltin_api_token, expiration_time = get_access_token(moltin_client_id,
                                                          moltin_client_secret)
 
-    # add_products_to_store(moltin_api_token)
-    # flow_slug = create_flow_and_fields(moltin_api_token)
-    # add_entries_to_flow(moltin_api_token, flow_slug)
+    if args.command == 'products':
+        print_report(add_products_to_store(moltin_api_token, database,
+                                           args.workers))
+    elif args.command == 'flow':
+        print(create_flow_and_fields(moltin_api_token, flow_slug))
+    elif args.command == 'pizzerias':
+        print_report(add_entries_to_flow(moltin_api_token, flow_slug,
+                                         args.workers))
+    elif args.command == 'sync-products':
+        print_report(sync_products(moltin_api_token, database, args.dry_run,
+                                   args.workers))
+    else:
+        print_report(sync_entries(moltin_api_token, flow_slug,
+                                  args.dry_run, args.workers))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,156 @@
+import json
+import math
+import time
+from array import array
+from collections import defaultdict
+from heapq import nsmallest
+from threading import Lock
+
+from catalog_model import Outlet, parse_outlet
+
+EARTH_RADIUS_KM = 6371.0088
+CELL_SIZE_DEG = 0.05
+INDEX_REFRESH_INTERVAL = 60 * 60
+INDEX_RETRY_INTERVAL = 60
+
+_index = None
+_index_built_at = 0
+_index_lock = Lock()
+
+
+def haversine_km(latitude_1, longitude_1, latitude_2, longitude_2):
+    phi_1 = math.radians(latitude_1)
+    phi_2 = math.radians(latitude_2)
+    d_phi = phi_2 - phi_1
+    d_lambda = math.radians(longitude_2 - longitude_1)
+    a = (math.sin(d_phi / 2) ** 2
+         + math.cos(phi_1) * math.cos(phi_2) * math.sin(d_lambda / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def load_pizzerias_from_file(path='address.json'):
+    with open(path, 'r') as file:
+        pizzeria_addresses = json.load(file)
+
+    return [
+        Outlet(
+            alias=pizzeria_address['alias'],
+            address=pizzeria_address['address']['full'],
+            latitude=float(pizzeria_address['coordinates']['lat']),
+            longitude=float(pizzeria_address['coordinates']['lon']),
+        )
+        for pizzeria_address in pizzeria_addresses
+    ]
+
+
+class PizzeriaIndex:
+    def __init__(self, pizzerias, cell_size=CELL_SIZE_DEG):
+        self.pizzerias = tuple(parse_outlet(pizzeria)
+                               for pizzeria in pizzerias)
+        self.cell_size = cell_size
+        self.latitudes = array('d', (pizzeria.latitude
+                                     for pizzeria in self.pizzerias))
+        self.longitudes = array('d', (pizzeria.longitude
+                                      for pizzeria in self.pizzerias))
+
+        cells = defaultdict(lambda: array('l'))
+        for number, pizzeria in enumerate(self.pizzerias):
+            cells[self.get_cell(pizzeria.latitude,
+                                pizzeria.longitude)].append(number)
+        self.cells = dict(cells)
+
+    def __len__(self):
+        return len(self.pizzerias)
+
+    def get_cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_size),
+                math.floor(longitude / self.cell_size))
+
+    def get_ring(self, row, column, radius):
+        if not radius:
+            yield row, column
+            return
+        for d_column in range(-radius, radius + 1):
+            yield row - radius, column + d_column
+            yield row + radius, column + d_column
+        for d_row in range(-radius + 1, radius):
+            yield row + d_row, column - radius
+            yield row + d_row, column + radius
+
+    def get_searched_distance(self, latitude, longitude, row, column, radius):
+        north = (row + radius + 1) * self.cell_size - latitude
+        south = latitude - (row - radius) * self.cell_size
+        east = (column + radius + 1) * self.cell_size - longitude
+        west = longitude - (column - radius) * self.cell_size
+
+        km_per_degree = math.radians(1) * EARTH_RADIUS_KM
+        latitude_gap = min(north, south) * km_per_degree
+        longitude_gap = math.radians(min(east, west, 90))
+        meridian_gap = EARTH_RADIUS_KM * math.asin(
+            math.cos(math.radians(latitude)) * math.sin(longitude_gap))
+        return min(latitude_gap, meridian_gap)
+
+    def nearest(self, latitude, longitude, k=1):
+        if not self.pizzerias:
+            return []
+
+        row, column = self.get_cell(latitude, longitude)
+        found = []
+        radius = 0
+        while (2 * radius + 1) ** 2 <= len(self.cells):
+            for cell in self.get_ring(row, column, radius):
+                found.extend(self.measure(latitude, longitude,
+                                          self.cells.get(cell, ())))
+            if len(found) >= k:
+                found = nsmallest(k, found)
+                searched_distance = self.get_searched_distance(
+                    latitude, longitude, row, column, radius)
+                if found[-1][0] <= searched_distance:
+                    return self.get_found(found)
+            radius += 1
+
+        found = self.measure(latitude, longitude, range(len(self)))
+        return self.get_found(nsmallest(k, found))
+
+    def measure(self, latitude, longitude, numbers):
+        latitudes = self.latitudes
+        longitudes = self.longitudes
+        return [
+            (haversine_km(latitude, longitude,
+                          latitudes[number], longitudes[number]), number)
+            for number in numbers
+        ]
+
+    def get_found(self, found):
+        return [(self.pizzerias[number], distance)
+                for distance, number in found]
+
+    def nearest_many(self, points, k=1):
+        return [self.nearest(latitude, longitude, k)
+                for latitude, longitude in points]
+
+
+def get_pizzeria_index(load_pizzerias, *args,
+                       refresh_interval=INDEX_REFRESH_INTERVAL):
+    global _index, _index_built_at
+
+    now = time.monotonic()
+    if _index is not None and now - _index_built_at < refresh_interval:
+        return _index
+
+    with _index_lock:
+        if _index is None or now - _index_built_at >= refresh_interval:
+            try:
+                _index = PizzeriaIndex(load_pizzerias(*args))
+                _index_built_at = now
+            except Exception:
+                if _index is None:
+                    raise
+                _index_built_at = now - refresh_interval + \
+                    INDEX_RETRY_INTERVAL
+    return _index
+
+
+def reset_pizzeria_index():
+    global _index
+    _index = None
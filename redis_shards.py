@@ -0,0 +1,62 @@
+import hashlib
+from bisect import bisect
+
+from tenants import get_key, get_tenant
+
+REPLICAS = 160
+
+
+def get_hash(key):
+    digest = hashlib.md5(str(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=REPLICAS):
+        points = sorted(
+            (get_hash(f'{node}#{replica}'), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError('HashRing needs at least one node')
+        self.hashes = [point_hash for point_hash, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def get_node(self, key):
+        number = bisect(self.hashes, get_hash(key)) % len(self.hashes)
+        return self.nodes[number]
+
+
+class ShardRouter:
+    def __init__(self, shards, replicas=REPLICAS):
+        self.shards = shards
+        self.ring = HashRing(shards, replicas)
+
+    @classmethod
+    def from_urls(cls, urls, client_class, **kwargs):
+        return cls({url: client_class.from_url(url) for url in urls},
+                   **kwargs)
+
+    def __iter__(self):
+        return iter(self.shards.values())
+
+    def get_shard(self, key):
+        return self.shards[self.ring.get_node(key)]
+
+    def get_tenant_shard(self):
+        return self.get_shard(get_tenant().name)
+
+    def get_chat_shard(self, chat_id):
+        return self.get_shard(get_key(chat_id))
+
+
+def get_redis_url(host, port, db=0):
+    return f'redis://{host}:{port}/{db}'
+
+
+def get_redis_urls(env):
+    return env.list('REDIS_SHARDS', []) or [
+        get_redis_url(env.str('REDIS_HOST'), env.int('REDIS_PORT'),
+                      env.int('REDIS_DB', 0))
+    ]
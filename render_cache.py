@@ -0,0 +1,116 @@
+import json
+from textwrap import dedent
+
+from catalog_cache import get_cached, load_product, load_products_page, \
+    set_cached
+from catalog_model import parse_product
+from moltin_api import iter_products
+
+MENU_PAGE_SIZE = 8
+MENU_PAGE_PREFIX = 'menu_page:'
+
+CART_BUTTON = {'text': 'Корзина', 'callback_data': 'cart_items'}
+BACK_BUTTON = {'text': 'Назад', 'callback_data': 'back-to-menu'}
+CHECKOUT_BUTTON = {'text': 'Оплатить',
+                   'callback_data': 'waiting_user_location'}
+
+
+def dump_keyboard(rows):
+    return json.dumps({'inline_keyboard': rows}, ensure_ascii=False)
+
+
+def get_menu_page_number(callback_data):
+    return int(callback_data[len(MENU_PAGE_PREFIX):])
+
+
+def render_menu_keyboard(products, page=0, has_next=False):
+    rows = [[{'text': product.name, 'callback_data': product.id}]
+            for product in products]
+    navigation = []
+    if page:
+        navigation.append({'text': '← Назад',
+                           'callback_data': f'{MENU_PAGE_PREFIX}{page - 1}'})
+    if has_next:
+        navigation.append({'text': 'Дальше →',
+                           'callback_data': f'{MENU_PAGE_PREFIX}{page + 1}'})
+    if navigation:
+        rows.append(navigation)
+    rows.append([CART_BUTTON])
+    return dump_keyboard(rows)
+
+
+def render_product_card(product):
+    text = f'''\
+    {product.name} \n            
+    Стоимость: {product.price} руб
+         
+    {product.description}
+    '''
+    keyboard = [
+        [{'text': 'Положить в корзину', 'callback_data': product.id}],
+        [BACK_BUTTON],
+    ]
+    return {
+        'image_id': product.image_id,
+        'caption': dedent(text),
+        'reply_markup': dump_keyboard(keyboard),
+    }
+
+
+# The render_* loaders run when their cached output is missing or stale,
+# so they load the catalog directly: a cached copy of the inputs would be
+# just as old and would be cached again under a fresh TTL.
+def render_menu_page(page, moltin_api_token):
+    offset = page * MENU_PAGE_SIZE
+    products, total = load_products_page(offset, MENU_PAGE_SIZE,
+                                         moltin_api_token)
+    if total is None:
+        has_next = len(products) == MENU_PAGE_SIZE
+    else:
+        has_next = offset + len(products) < total
+
+    for product in products:
+        set_cached(('product_card', product.id),
+                   render_product_card(product))
+    return render_menu_keyboard(products, page, has_next)
+
+
+def get_menu_keyboard(moltin_api_token, page=0):
+    return get_cached(('menu_page', page), render_menu_page, page,
+                      moltin_api_token)
+
+
+def render_product_card_by_id(product_id, moltin_api_token):
+    return render_product_card(load_product(product_id, moltin_api_token))
+
+
+def get_product_card(product_id, moltin_api_token):
+    return get_cached(('product_card', product_id),
+                      render_product_card_by_id, product_id, moltin_api_token)
+
+
+def warm_product_cards(moltin_api_token):
+    warmed = 0
+    for product in iter_products(moltin_api_token):
+        product = parse_product(product)
+        set_cached(('product_card', product.id),
+                   render_product_card(product))
+        warmed += 1
+    return warmed
+
+
+def render_cart(cart):
+    parts = []
+    keyboard = []
+    for product in cart['data']:
+        price = product['meta']['display_price']['with_tax']['value']
+        parts.append(f'\n{product["name"]}\n{product["description"]}\n'
+                     f'{product["quantity"]} пицц в корзине на сумму '
+                     f'{price["formatted"]} \n\n')
+        keyboard.append([{'text': f'Убрать из корзины {product["name"]}',
+                          'callback_data': product['id']}])
+    cart_price = cart['meta']['display_price']['with_tax']['formatted']
+    parts.append(f'К оплате: {cart_price}')
+    keyboard.append([BACK_BUTTON])
+    keyboard.append([CHECKOUT_BUTTON])
+    return ''.join(parts), dump_keyboard(keyboard)
@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import TELEGRAM_RETRIES, TELEGRAM_SEND_QUEUE, TELEGRAM_SEND_WAIT
+from rate_limiter import TokenBucket
+
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+MAX_CHAT_BUCKETS = 10000
+MAX_RETRIES = 3
+
+CHAT_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup',
+    'editMessageText', 'editMessageCaption', 'editMessageMedia',
+    'editMessageReplyMarkup',
+})
+THROTTLED_METHODS = CHAT_METHODS | {
+    'deleteMessage', 'answerCallbackQuery', 'sendChatAction',
+}
+
+
+def get_api_method(url):
+    return url.rsplit('/', 1)[-1]
+
+
+def is_group_chat(chat_id):
+    return str(chat_id).startswith(('-', '@'))
+
+
+class SendScheduler:
+    def __init__(self, request, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RETRIES):
+        self.request = request
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.waiting = 0
+        self._chat_buckets = OrderedDict()
+        self._lock = Lock()
+        TELEGRAM_SEND_QUEUE.set_function(lambda: self.waiting)
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    def get_chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is not None:
+                self._chat_buckets.move_to_end(chat_id)
+                return bucket
+            rate = GROUP_CHAT_RATE if is_group_chat(chat_id) \
+                else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                rate, capacity=self.chat_burst)
+            while len(self._chat_buckets) > MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+            return bucket
+
+    def wait_turn(self, method, chat_bucket):
+        with self._lock:
+            self.waiting += 1
+        started_at = time.perf_counter()
+        try:
+            if chat_bucket is not None:
+                chat_bucket.acquire()
+            self.global_bucket.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+            TELEGRAM_SEND_WAIT.observe(time.perf_counter() - started_at,
+                                       method=method)
+
+    def post(self, url, data, timeout=None):
+        method = get_api_method(url)
+        if method not in THROTTLED_METHODS:
+            return self.request.post(url, data, timeout=timeout)
+
+        chat_bucket = None
+        if method in CHAT_METHODS and self.chat_rate and \
+                data.get('chat_id') is not None:
+            chat_bucket = self.get_chat_bucket(data['chat_id'])
+        for attempt in range(self.max_retries + 1):
+            self.wait_turn(method, chat_bucket)
+            try:
+                return self.request.post(url, data, timeout=timeout)
+            except RetryAfter as err:
+                if attempt == self.max_retries:
+                    raise
+                TELEGRAM_RETRIES.inc(method=method)
+                (chat_bucket or self.global_bucket).pause(err.retry_after)
+
+
+def throttle_bot(bot, **limits):
+    if not isinstance(bot._request, SendScheduler):
+        bot._request = SendScheduler(bot._request, **limits)
+    return bot
+
+
+def replace_message(bot, message, text, reply_markup=None):
+    if message.text is not None:
+        try:
+            return bot.edit_message_text(text,
+                                         chat_id=message.chat_id,
+                                         message_id=message.message_id,
+                                         reply_markup=reply_markup)
+        except BadRequest:
+            pass
+
+    new_message = bot.send_message(chat_id=message.chat_id, text=text,
+                                   reply_markup=reply_markup)
+    bot.delete_message(chat_id=message.chat_id,
+                       message_id=message.message_id)
+    return new_message
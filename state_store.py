@@ -0,0 +1,158 @@
+import logging
+import time
+from threading import Lock, Thread
+
+from tenants import get_key, get_tenant
+
+STATE_TTL = 30 * 24 * 60 * 60
+STATE_KEY = 'chat:{}'
+STATE_FIELD = 'state'
+FLUSH_INTERVAL = 0.05
+
+logger = logging.getLogger('tg_logger')
+
+
+def get_state_key(chat_id):
+    return get_key(STATE_KEY.format(chat_id))
+
+
+def has_legacy_keys():
+    return not get_tenant().name
+
+
+def decode(value):
+    if value is None:
+        return None
+    return value.decode('utf-8')
+
+
+class ConversationStateStore:
+    def __init__(self, database, ttl=STATE_TTL, write_behind=False,
+                 flush_interval=FLUSH_INTERVAL, get_chat_database=None):
+        self.database = database
+        self.get_chat_database = get_chat_database or (lambda _: database)
+        self.ttl = ttl
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self._dirty = {}
+        self._in_flight = {}
+        self._lock = Lock()
+        self._thread = None
+
+    def load(self, chat_id, *keys):
+        with self._lock:
+            state = self._dirty.get(chat_id, self._in_flight.get(chat_id))
+
+        legacy = has_legacy_keys()
+        pipeline = self.get_chat_database(chat_id).pipeline(transaction=False)
+        if state is None:
+            pipeline.hget(get_state_key(chat_id), STATE_FIELD)
+            if legacy:
+                pipeline.get(chat_id)
+        for key in keys:
+            pipeline.get(key)
+        values = pipeline.execute()
+
+        if state is None:
+            state, *values = values
+            if legacy:
+                legacy_state, *values = values
+                state = state or legacy_state
+            state = decode(state)
+        return (state, *values)
+
+    def get_state(self, chat_id):
+        state, = self.load(chat_id)
+        return state
+
+    def set_state(self, chat_id, state):
+        if self.write_behind:
+            with self._lock:
+                self._dirty[chat_id] = state
+            self.start()
+            return
+
+        pipeline = self.get_chat_database(chat_id).pipeline(transaction=False)
+        self.add_state_writes(pipeline, chat_id, state)
+        pipeline.execute()
+
+    def add_state_writes(self, pipeline, chat_id, state):
+        key = get_state_key(chat_id)
+        pipeline.hset(key, STATE_FIELD, state)
+        pipeline.expire(key, self.ttl)
+        if has_legacy_keys():
+            pipeline.delete(chat_id)
+
+    def flush(self):
+        # Entries being written stay readable from _in_flight until the
+        # pipelines return, so load() never falls back to the old state.
+        with self._lock:
+            dirty = self._in_flight = self._dirty
+            self._dirty = {}
+        if not dirty:
+            return 0
+
+        pipelines = {}
+        for chat_id, state in dirty.items():
+            database = self.get_chat_database(chat_id)
+            pipeline = pipelines.get(id(database))
+            if pipeline is None:
+                pipeline = pipelines[id(database)] = database.pipeline(
+                    transaction=False)
+            self.add_state_writes(pipeline, chat_id, state)
+        try:
+            for pipeline in pipelines.values():
+                pipeline.execute()
+        except Exception:
+            with self._lock:
+                self._dirty = {**dirty, **self._dirty}
+            raise
+        finally:
+            with self._lock:
+                self._in_flight = {}
+        return len(dirty)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self.run_flush_loop, daemon=True)
+            self._thread.start()
+
+    def restart_after_fork(self):
+        self._lock = Lock()
+        self._dirty = {}
+        self._in_flight = {}
+        self._thread = None
+
+    def run_flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Conversation state flush failed')
+
+
+class AsyncConversationStateStore:
+    def __init__(self, database, ttl=STATE_TTL, get_chat_database=None):
+        self.database = database
+        self.get_chat_database = get_chat_database or (lambda _: database)
+        self.ttl = ttl
+
+    async def get_state(self, chat_id):
+        pipeline = self.get_chat_database(chat_id).pipeline(transaction=False)
+        pipeline.hget(get_state_key(chat_id), STATE_FIELD)
+        if has_legacy_keys():
+            pipeline.get(chat_id)
+        state, *legacy_state = await pipeline.execute()
+        if state is None and legacy_state:
+            state = legacy_state[0]
+        return decode(state)
+
+    async def set_state(self, chat_id, state):
+        key = get_state_key(chat_id)
+        pipeline = self.get_chat_database(chat_id).pipeline(transaction=False)
+        pipeline.hset(key, STATE_FIELD, state)
+        pipeline.expire(key, self.ttl)
+        if has_legacy_keys():
+            pipeline.delete(chat_id)
+        await pipeline.execute()
@@ -0,0 +1,66 @@
+import os
+import re
+from collections import namedtuple
+
+from delivery_zones import ZONES_PATH
+
+TENANTS_DIR = 'tenants'
+MENU_PATH = 'menu.json'
+ADDRESS_PATH = 'address.json'
+FLOW_SLUG = 'pizzeria'
+TENANT_NAME_RE = re.compile(r'[a-z0-9][a-z0-9-]*')
+
+Tenant = namedtuple('Tenant', [
+    'name',
+    'menu_path',
+    'address_path',
+    'zones_path',
+    'flow_slug',
+])
+
+
+def get_tenant_path(name, filename):
+    if not name:
+        return filename
+    return os.path.join(TENANTS_DIR, name, filename)
+
+
+def load_tenant(name=''):
+    if name and not TENANT_NAME_RE.fullmatch(name):
+        raise ValueError(f'Invalid tenant name: {name!r}')
+
+    zones_path = get_tenant_path(name, ZONES_PATH)
+    if not os.path.exists(zones_path):
+        zones_path = ZONES_PATH
+    return Tenant(
+        name=name,
+        menu_path=get_tenant_path(name, MENU_PATH),
+        address_path=get_tenant_path(name, ADDRESS_PATH),
+        zones_path=zones_path,
+        flow_slug=f'{FLOW_SLUG}-{name}' if name else FLOW_SLUG,
+    )
+
+
+_tenant = load_tenant()
+
+
+def set_tenant(name):
+    global _tenant
+    _tenant = load_tenant(name)
+    return _tenant
+
+
+def get_tenant():
+    return _tenant
+
+
+def get_key(key):
+    if not _tenant.name:
+        return key
+    return f'{_tenant.name}:{key}'
+
+
+def get_cart_reference(chat_id):
+    if not _tenant.name:
+        return chat_id
+    return f'{_tenant.name}-{chat_id}'
@@ -1,69 +1,68 @@
 import logging
-from textwrap import dedent
+import os
+from functools import partial
 
-import redis
 import requests as requests
 
-from geopy import distance
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Filters, Updater
-from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
-from environs import Env
-from logs_handler import CustomLogsHandler
-
-from moltin_api import get_products, add_product_to_cart, \
-    get_product, get_image_url, get_cart, remove_cart_item, create_customer, \
-    get_access_token, get_all_restaurants
-
-_database = None
+from app import App, load_config
+from pizzeria_index import get_pizzeria_index
+from delivery_zones import get_delivery_zones
+from geocode_cache import get_cached_coordinates, geocode_stats
+from media_cache import send_product_photo, media_stats
+from cart_mirror import get_cart_generation, get_mirrored_cart, \
+    refresh_cart, save_cart, cart_stats
+from circuit_breaker import CircuitOpenError, get_breaker
+from catalog_cache import get_cached_image_url, check_catalog_version, \
+    catalog_stats
+from order_pipeline import enqueue_checkout
+from tenants import get_cart_reference, get_tenant
+from send_scheduler import replace_message, throttle_bot
+from render_cache import MENU_PAGE_PREFIX, get_menu_keyboard, \
+    get_menu_page_number, get_product_card, render_cart, \
+    warm_product_cards
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY, GEOCODER_ERRORS, \
+    GEOCODER_LATENCY, register_cache, start_metrics_server, trace_logger, \
+    trace_update
+
+from moltin_api import add_product_to_cart, get_cart, remove_cart_item, \
+    create_customer, get_all_restaurants
+
+GEOCODER_URL = os.environ.get('YANDEX_GEOCODER_URL',
+                              'https://geocode-maps.yandex.ru/1.x')
+GEOCODER_TIMEOUT = (3.05, 5)
+
+_app = None
 
 logger = logging.getLogger('tg_logger')
 
 
-def add_keyboard():
-    keyboard = []
+def add_keyboard(page=0):
+    moltin_api_token = get_moltin_api_token()
 
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
+    return get_menu_keyboard(moltin_api_token, page)
 
-    moltin_api_token = get_or_create_moltin_api_token(
-        env("MOLTIN_CLIENT_ID"),
-        env("MOLTIN_CLIENT_SECRET"),
-        db
-    )
 
-    products = get_products(moltin_api_token)
-    for product in products:
-        keyboard.append([InlineKeyboardButton(product['name'],
-                                              callback_data=product['id'])])
-
-    keyboard.append([InlineKeyboardButton('Корзина',
-                                          callback_data='cart_items')])
+def start(bot, update):
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = add_keyboard()
 
-    return reply_markup
+    update.message.reply_text('Выберите пиццу:', reply_markup=reply_markup)
+    return "HANDLE_MENU"
 
 
-def start(bot, update):
+def handle_menu_page(bot, update):
+    query = update.callback_query
 
-    reply_markup = add_keyboard()
+    reply_markup = add_keyboard(get_menu_page_number(query.data))
 
-    update.message.reply_text('Выберите пиццу:', reply_markup=reply_markup)
+    bot.edit_message_reply_markup(chat_id=query.message.chat_id,
+                                  message_id=query.message.message_id,
+                                  reply_markup=reply_markup)
     return "HANDLE_MENU"
 
 
 def back_to_menu(bot, update):
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
-
-    moltin_api_token = get_or_create_moltin_api_token(
-        env("MOLTIN_CLIENT_ID"),
-        env("MOLTIN_CLIENT_SECRET"),
-        db
-    )
+    moltin_api_token = get_moltin_api_token()
 
     query = update.callback_query
 
@@ -71,91 +70,51 @@ def back_to_menu(bot, update):
 
         reply_markup = add_keyboard()
 
-        query.message.reply_text('Выберите пиццу:', reply_markup=reply_markup)
-
-        bot.delete_message(chat_id=query.message.chat_id,
-                           message_id=query.message.message_id)
+        replace_message(bot, query.message, 'Выберите пиццу:',
+                        reply_markup=reply_markup)
 
         return "HANDLE_MENU"
     else:
         chat_id = query.message.chat_id
         product_id = query.data
-        cart_items = add_product_to_cart(chat_id,
-                                         product_id,
-                                         moltin_api_token)
+        cart = add_product_to_cart(get_cart_reference(chat_id),
+                                   product_id,
+                                   moltin_api_token,
+                                   with_meta=True)
+        db = get_database_connection(chat_id)
+        save_cart(db, chat_id, cart)
         return "HANDLE_DESCRIPTION"
 
 
 def handle_menu(bot, update):
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
-
-    moltin_api_token = get_or_create_moltin_api_token(
-        env("MOLTIN_CLIENT_ID"),
-        env("MOLTIN_CLIENT_SECRET"),
-        db
-    )
+    moltin_api_token = get_moltin_api_token()
 
     query = update.callback_query
 
     if query.data == 'cart_items':
-        cart = get_cart(query.message.chat_id, moltin_api_token)
-        cart_info = ''
-        for product in cart['data']:
-            text = f'''
-            {product['name']}
-            {product['description']}
-            {product['quantity']} пицц в корзине на сумму {product['meta']['display_price']['with_tax']['value']['formatted']} \n
-            '''
-            cart_info = cart_info + text
-        cart_price = cart['meta']['display_price']['with_tax']['formatted']
-        cart_info = cart_info + f'К оплате: {cart_price}'
-
-        keyboard = []
-        for product in cart['data']:
-            keyboard.append([InlineKeyboardButton(
-                f'Убрать из корзины {product["name"]}',
-                callback_data=product['id'])])
-
-        keyboard.append([InlineKeyboardButton('Назад',
-                                              callback_data='back-to-menu')])
-        keyboard.append([InlineKeyboardButton(
-            'Оплатить',
-            callback_data='waiting_user_location'
-        )])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        bot.send_message(
-            chat_id=query.message.chat_id,
-            text=dedent(cart_info),
-            reply_markup=reply_markup
-        )
-
-        bot.delete_message(chat_id=query.message.chat_id,
-                           message_id=query.message.message_id)
+        chat_id = query.message.chat_id
+        db = get_database_connection(chat_id)
+        cart = get_mirrored_cart(db, chat_id,
+                                 partial(get_cart, get_cart_reference(chat_id),
+                                         moltin_api_token))
+        cart_info, reply_markup = render_cart(cart)
+
+        replace_message(bot, query.message, cart_info,
+                        reply_markup=reply_markup)
         return "HANDLE_CART"
     else:
-        product = get_product(query.data, moltin_api_token)
-        image_id = product['relationships']['main_image']['data']['id']
-        text = f'''\
-        {product['name']} \n            
-        Стоимость: {product['price'][0]['amount']} руб
-             
-        {product['description']}
-        '''
-        keyboard = [[InlineKeyboardButton("Положить в корзину", callback_data=product["id"])],
-
-                    [InlineKeyboardButton('Назад', callback_data='back-to-menu')]]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        bot.send_photo(
-            chat_id=query.message.chat_id,
-            photo=get_image_url(image_id, moltin_api_token),
-            caption=dedent(text),
-            reply_markup=reply_markup
+        card = get_product_card(query.data, moltin_api_token)
+        image_id = card['image_id']
+
+        db = get_database_connection()
+        send_product_photo(
+            bot,
+            db,
+            query.message.chat_id,
+            image_id,
+            partial(get_cached_image_url, image_id, moltin_api_token),
+            caption=card['caption'],
+            reply_markup=card['reply_markup']
         )
         bot.delete_message(chat_id=query.message.chat_id,
                            message_id=query.message.message_id)
@@ -164,45 +123,38 @@ def handle_menu(bot, update):
 
 
 def handle_cart(bot, update):
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
-
-    moltin_api_token = get_or_create_moltin_api_token(
-        env("MOLTIN_CLIENT_ID"),
-        env("MOLTIN_CLIENT_SECRET"),
-        db
-    )
+    moltin_api_token = get_moltin_api_token()
 
     query = update.callback_query
 
     if query.data == "waiting_user_location":
+        chat_id = query.message.chat_id
+        db = get_database_connection(chat_id)
+        refresh_cart(db, chat_id, partial(get_cart,
+                                          get_cart_reference(chat_id),
+                                          moltin_api_token))
         query.message.reply_text('Пришлите нам ваш адрес или геолокацию')
         return 'HANDLE_LOCATION'
     if query.data == "back-to-menu":
 
         reply_markup = add_keyboard()
 
-        query.message.reply_text('Выберите пиццу:', reply_markup=reply_markup)
-
-        bot.delete_message(chat_id=query.message.chat_id,
-                           message_id=query.message.message_id)
+        replace_message(bot, query.message, 'Выберите пиццу:',
+                        reply_markup=reply_markup)
         return "HANDLE_MENU"
     else:
-        remove_cart_item(query.message.chat_id, query.data, moltin_api_token)
+        chat_id = query.message.chat_id
+        cart = remove_cart_item(get_cart_reference(chat_id), query.data,
+                                moltin_api_token, with_meta=True)
+        db = get_database_connection(chat_id)
+        save_cart(db, chat_id, cart)
         return "HANDLE_DESCRIPTION"
 
 
 def handle_user_geolocation(bot, update):
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
+    db = get_database_connection()
 
-    moltin_api_token = get_or_create_moltin_api_token(
-        env("MOLTIN_CLIENT_ID"),
-        env("MOLTIN_CLIENT_SECRET"),
-        db
-    )
+    moltin_api_token = get_moltin_api_token()
 
     if update.message.location:
         message = update.message
@@ -213,109 +165,164 @@ def handle_user_geolocation(bot, update):
         )
     else:
         message = update.message
-        current_position = fetch_coordinates(
-            env('YANDEX_GEO_APIKEY'),
-            update.message.text
-        )
+        try:
+            current_position = get_cached_coordinates(
+                db,
+                fetch_coordinates,
+                get_app().config.yandex_apikey,
+                update.message.text
+            )
+        except (CircuitOpenError, requests.RequestException):
+            update.message.reply_text(
+                'Не удалось найти адрес, пришлите, пожалуйста, геолокацию')
+            return 'HANDLE_LOCATION'
         if not current_position:
             update.message.reply_text('Не могу распознать адрес')
             return 'HANDLE_LOCATION'
 
-    restaurants = get_all_restaurants(moltin_api_token)
-
-    for restaurant in restaurants:
-        restaurant_position = restaurant['latitude'], restaurant['longitude']
-        restaurant['distance'] = distance.distance(
-            restaurant_position,
-            current_position
-        ).km
-
-    nearest_restaurant = min(restaurants, key=get_distance)
-    distance_between_rest_and_user = nearest_restaurant['distance']
-    if distance_between_rest_and_user <= 0.5:
+    tenant = get_tenant()
+    pizzeria_index = get_pizzeria_index(get_all_restaurants,
+                                        moltin_api_token, tenant.flow_slug)
+    delivery_zones = get_delivery_zones(pizzeria_index, tenant.zones_path)
+    nearest_restaurant, delivery_tier = delivery_zones.quote(*current_position)
+    chat_id = message.chat_id
+    chat_db = get_database_connection(chat_id)
+    cart = get_mirrored_cart(chat_db, chat_id,
+                             partial(get_cart, get_cart_reference(chat_id),
+                                     moltin_api_token))
+    if delivery_tier is not None and cart.get('data'):
+        enqueue_checkout(db, chat_id, message.from_user.first_name, cart,
+                         current_position, nearest_restaurant, delivery_tier,
+                         address=message.text,
+                         cart_generation=get_cart_generation(chat_db,
+                                                             chat_id))
+    if delivery_tier is None:
         update.message.reply_text(
-            'Можете забрать пиццу сами, либо с бесплатной доставкой'
-        )
-    elif 0.5 < distance_between_rest_and_user <= 5:
-        update.message.reply_text('Доставка будет стоить 100 рублей')
-    elif 5 < distance_between_rest_and_user <= 20:
+            'К сожалению, вы слишком далеко, возможен только самовывоз')
+    elif not delivery_tier['price']:
         update.message.reply_text(
-            'Доставка будет стоить 300 рублей'
+            'Можете забрать пиццу сами, либо с бесплатной доставкой'
         )
     else:
         update.message.reply_text(
-            'К сожалению, вы слишком далеко, возможен только самовывоз')
+            f'Доставка будет стоить {delivery_tier["price"]} рублей')
 
     return 'HANDLE_LOCATION'
 
 
-def get_distance(restaurant):
-    return restaurant['distance']
+def get_update_chat(update):
+    if update.message:
+        return update.message.chat_id, update.message.text
+    if update.callback_query:
+        return update.callback_query.message.chat_id, update.callback_query.data
+    return None, None
+
+
+def run_state_handler(bot, update, user_state):
+    app = get_app()
+    check_catalog_version(app.database)
+
+    _, user_reply = get_update_chat(update)
+    if user_reply and user_reply.startswith(MENU_PAGE_PREFIX):
+        user_state = 'HANDLE_MENU_PAGE'
+    elif update.message and update.message.location:
+        user_state = 'HANDLE_LOCATION'
+    state_handler = app.handlers[user_state]
+    with trace_update(user_state), \
+            HANDLER_LATENCY.time(handler=state_handler.__name__):
+        try:
+            return state_handler(bot, update)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=state_handler.__name__)
+            raise
 
 
 def handle_users_reply(bot, update):
 
-    db = get_database_connection(database_password,
-                                 database_host,
-                                 database_port)
-    if update.message:
-        user_reply = update.message.text
-        chat_id = update.message.chat_id
-    elif update.callback_query:
-        user_reply = update.callback_query.data
-        chat_id = update.callback_query.message.chat_id
-    else:
+    state_store = get_app().state_store
+    chat_id, user_reply = get_update_chat(update)
+    if chat_id is None:
         return
     if user_reply == '/start':
         user_state = 'START'
     else:
-        user_state = db.get(chat_id).decode("utf-8")
+        user_state = state_store.get_state(chat_id) or 'START'
+
+    try:
+        next_state = run_state_handler(bot, update, user_state)
+        state_store.set_state(chat_id, next_state)
+    except Exception:
+        logger.exception('Update %s failed', update.update_id)
+        notify_failure(bot, chat_id)
+
 
-    states_functions = {
+def notify_failure(bot, chat_id):
+    try:
+        bot.send_message(chat_id=chat_id,
+                         text='Сервис временно недоступен, попробуйте позже')
+    except Exception:
+        logger.exception('Could not notify chat %s', chat_id)
+
+
+def create_app(config):
+    global _app
+
+    handlers = {
         'START': start,
+        'HANDLE_MENU_PAGE': handle_menu_page,
         'HANDLE_MENU': handle_menu,
         'HANDLE_DESCRIPTION': back_to_menu,
         'HANDLE_CART': handle_cart,
         'HANDLE_LOCATION': handle_user_geolocation,
     }
-    state_handler = states_functions[user_state]
+    _app = App(config, handlers)
+    return _app
 
-    try:
-        next_state = state_handler(bot, update)
-        db.set(chat_id, next_state)
-    except Exception as err:
-        print(err)
 
+def get_app():
+    if _app is None:
+        raise RuntimeError('create_app() has not been called')
+    return _app
 
-def get_database_connection(database_password, database_host, database_port):
 
-    global _database
-    if _database is None:
-        _database = redis.Redis(host=database_host, port=database_port, db=0)
-    return _database
+def get_database_connection(chat_id=None):
+    app = get_app()
+    if chat_id is None:
+        return app.database
+    return app.shards.get_chat_shard(chat_id)
 
 
-def get_or_create_moltin_api_token(moltin_client_id,
-                                   moltin_client_secret,
-                                   database):
+def get_moltin_api_token():
+    return get_app().get_moltin_api_token()
 
-    if database.get('moltin_api_token'):
-        moltin_api_token = database.get('moltin_api_token').decode("utf-8")
-    else:
-        moltin_api_token, expire_time = get_access_token(moltin_client_id,
-                                                         moltin_client_secret)
-        database.set('moltin_api_token', moltin_api_token, ex=expire_time)
-    return moltin_api_token
+
+def warm_catalog(app):
+    moltin_api_token = app.get_moltin_api_token()
+    get_menu_keyboard(moltin_api_token)
+    warm_product_cards(moltin_api_token)
+    pizzeria_index = get_pizzeria_index(get_all_restaurants,
+                                        moltin_api_token,
+                                        app.tenant.flow_slug)
+    get_delivery_zones(pizzeria_index, app.tenant.zones_path).precompute()
 
 
 def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
-    response = requests.get(base_url, params={
-        "geocode": address,
-        "apikey": apikey,
-        "format": "json",
-    })
-    response.raise_for_status()
+    return get_breaker('geocoder').call(request_coordinates, apikey, address)
+
+
+def request_coordinates(apikey, address):
+    with GEOCODER_LATENCY.time():
+        try:
+            response = requests.get(GEOCODER_URL, params={
+                "geocode": address,
+                "apikey": apikey,
+                "format": "json",
+            }, timeout=GEOCODER_TIMEOUT)
+            response.raise_for_status()
+        except requests.RequestException as err:
+            status = getattr(err.response, 'status_code', 'error')
+            GEOCODER_ERRORS.inc(status=status)
+            raise
     found_places = response.json()['response']['GeoObjectCollection']['featureMember']
 
     if not found_places:
@@ -326,25 +333,84 @@ def fetch_coordinates(apikey, address):
     return float(lat), float(lon)
 
 
-if __name__ == '__main__':
+def main():
+    from environs import Env
+    from telegram import Bot
+
+    from logs_handler import CustomLogsHandler
 
     env = Env()
     env.read_env()
-    token = env("TELEGRAM_TOKEN")
-    chat_id = env("CHAT_ID")
-    database_password = env("REDIS_PASSWORD")
-    database_host = env("REDIS_HOST")
-    database_port = env("REDIS_PORT")
-    updater = Updater(token)
+    app = create_app(load_config(env))
+    config = app.config
     logger.setLevel(logging.WARNING)
-    logger.addHandler(CustomLogsHandler(chat_id, token))
-    dispatcher = updater.dispatcher
-    dispatcher.add_handler(CallbackQueryHandler(handle_users_reply))
-    dispatcher.add_handler(MessageHandler(Filters.text, handle_users_reply))
-    dispatcher.add_handler(MessageHandler(
-        Filters.location,
-        handle_user_geolocation
-    )
-    )
-    dispatcher.add_handler(CommandHandler('start', handle_users_reply))
-    updater.start_polling()
+    logger.addHandler(CustomLogsHandler(config.chat_id,
+                                        config.telegram_token))
+    if config.trace_updates:
+        logging.basicConfig()
+        trace_logger.setLevel(logging.DEBUG)
+
+    register_cache('catalog', catalog_stats, hit_keys=('hits', 'stale'))
+    register_cache('geocode', geocode_stats,
+                   hit_keys=('hits', 'negative_hits'))
+    register_cache('cart', cart_stats)
+    register_cache('media', media_stats)
+    if config.metrics_port:
+        start_metrics_server(config.metrics_port)
+    if config.preload:
+        app.preload(warm_catalog)
+
+    token = config.telegram_token
+    telegram_api_url = config.telegram_api_url
+    bot_runtime = env.str('BOT_RUNTIME', 'polling')
+    if bot_runtime == 'asyncio':
+        import asyncio
+
+        from async_runtime import run_bot
+
+        bot = throttle_bot(Bot(token, base_url=telegram_api_url))
+        asyncio.run(run_bot(bot,
+                            config.redis_shards,
+                            get_update_chat,
+                            run_state_handler,
+                            workers=env.int('ASYNC_WORKERS', 100),
+                            notify_failure=notify_failure,
+                            state_ttl=config.state_ttl))
+    elif bot_runtime == 'webhook':
+        from webhook import run_webhook
+
+        webhook_path = f'/{env.str("WEBHOOK_SECRET")}'
+        bot = Bot(token, base_url=telegram_api_url)
+        bot.set_webhook(url=f'{env.str("WEBHOOK_URL")}{webhook_path}')
+        webhook_workers = env.int('WEBHOOK_WORKERS', 4)
+        run_webhook(token,
+                    config.redis_shards,
+                    handle_users_reply,
+                    env.str('WEBHOOK_HOST', '0.0.0.0'),
+                    env.int('WEBHOOK_PORT', 8443),
+                    webhook_path,
+                    webhook_workers,
+                    worker_offset=env.int('WORKER_OFFSET', 0),
+                    worker_count=env.int('WORKER_COUNT', webhook_workers),
+                    partitions=env.int('WEBHOOK_PARTITIONS', 16),
+                    metrics_port=config.metrics_port,
+                    telegram_api_url=telegram_api_url)
+    else:
+        from telegram.ext import CallbackQueryHandler, CommandHandler, \
+            Filters, MessageHandler, Updater
+
+        updater = Updater(token, base_url=telegram_api_url)
+        # The dispatcher runs handlers one at a time, so waiting on one
+        # chat's quota would hold up every other chat.
+        throttle_bot(updater.bot, chat_rate=None)
+        dispatcher = updater.dispatcher
+        dispatcher.add_handler(CallbackQueryHandler(handle_users_reply))
+        dispatcher.add_handler(MessageHandler(Filters.text, handle_users_reply))
+        dispatcher.add_handler(MessageHandler(Filters.location,
+                                              handle_users_reply))
+        dispatcher.add_handler(CommandHandler('start', handle_users_reply))
+        updater.start_polling()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import logging
+import time
+from threading import Lock, Thread
+
+from redis.exceptions import LockError
+
+from moltin_api import get_access_token
+from tenants import get_key
+
+TOKEN_KEY = 'moltin_api_token'
+LOCK_KEY = 'moltin_api_token:lock'
+REFRESH_MARGIN = 60
+LOCK_TIMEOUT = 30
+RETRY_DELAY = 5
+
+logger = logging.getLogger('tg_logger')
+
+
+class MoltinTokenManager:
+    def __init__(self, moltin_client_id, moltin_client_secret, database,
+                 refresh_margin=REFRESH_MARGIN, lock_timeout=LOCK_TIMEOUT):
+        self.moltin_client_id = moltin_client_id
+        self.moltin_client_secret = moltin_client_secret
+        self.database = database
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+        self._token = None
+        self._expires_at = 0
+        self._lock = Lock()
+        self._thread = None
+
+    def get_token(self):
+        if self._token is None or time.time() >= self._expires_at:
+            with self._lock:
+                if self._token is None or time.time() >= self._expires_at:
+                    self.refresh()
+        return self._token
+
+    def refresh(self):
+        if self.adopt_shared_token():
+            return
+
+        try:
+            with self.database.lock(get_key(LOCK_KEY),
+                                    timeout=self.lock_timeout,
+                                    blocking_timeout=self.lock_timeout):
+                if self.adopt_shared_token():
+                    return
+                moltin_api_token, expire_time = get_access_token(
+                    self.moltin_client_id,
+                    self.moltin_client_secret
+                )
+                self.database.set(get_key(TOKEN_KEY), moltin_api_token,
+                                  ex=expire_time)
+                self._token = moltin_api_token
+                self._expires_at = time.time() + expire_time
+        except LockError:
+            if not self.adopt_shared_token():
+                raise
+
+    def adopt_shared_token(self):
+        pipeline = self.database.pipeline(transaction=False)
+        token_key = get_key(TOKEN_KEY)
+        pipeline.get(token_key)
+        pipeline.ttl(token_key)
+        moltin_api_token, ttl = pipeline.execute()
+
+        if moltin_api_token is None or ttl <= self.refresh_margin:
+            return False
+        self._token = moltin_api_token.decode('utf-8')
+        self._expires_at = time.time() + ttl
+        return True
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(target=self.run_refresh_loop, daemon=True)
+            self._thread.start()
+
+    def restart_after_fork(self):
+        self._lock = Lock()
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+    def run_refresh_loop(self):
+        while True:
+            delay = self._expires_at - self.refresh_margin - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                with self._lock:
+                    self.refresh()
+            except Exception:
+                logger.exception('Moltin token refresh failed')
+                time.sleep(RETRY_DELAY)
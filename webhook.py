@@ -0,0 +1,190 @@
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+from telegram import Bot, Update
+
+from metrics import start_metrics_server
+from redis_shards import ShardRouter
+from send_scheduler import GLOBAL_RATE, throttle_bot
+from tenants import get_key
+
+STREAM_KEY = 'updates:{}'
+GROUP_NAME = 'workers'
+PARTITIONS = 16
+STREAM_MAXLEN = 100000
+READ_COUNT = 10
+READ_BLOCK_MS = 5000
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+SUPERVISE_INTERVAL = 5
+
+logger = logging.getLogger('tg_logger')
+
+
+def get_update_chat_id(update_data):
+    for field in ('message', 'edited_message'):
+        if field in update_data:
+            return update_data[field]['chat']['id']
+    callback_query = update_data.get('callback_query')
+    if callback_query and 'message' in callback_query:
+        return callback_query['message']['chat']['id']
+    return None
+
+
+def get_stream_key(partition):
+    return get_key(STREAM_KEY.format(partition))
+
+
+def get_partition(chat_id, partitions=PARTITIONS):
+    return chat_id % partitions
+
+
+def get_worker_partitions(worker_index, worker_count, partitions=PARTITIONS):
+    return [partition for partition in range(partitions)
+            if partition % worker_count == worker_index]
+
+
+def enqueue_update(database, update_data, partitions=PARTITIONS):
+    chat_id = get_update_chat_id(update_data)
+    if chat_id is None:
+        return None
+    stream = get_stream_key(get_partition(chat_id, partitions))
+    return database.xadd(stream, {'update': json.dumps(update_data)},
+                         maxlen=STREAM_MAXLEN, approximate=True)
+
+
+def create_groups(database, partitions=PARTITIONS):
+    for partition in range(partitions):
+        try:
+            database.xgroup_create(get_stream_key(partition), GROUP_NAME,
+                                   id='0', mkstream=True)
+        except redis.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+
+def make_request_handler(database, secret_path, partitions):
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != secret_path:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                update_data = json.loads(self.rfile.read(length))
+                enqueue_update(database, update_data, partitions)
+            except ValueError:
+                self.send_response(400)
+            except redis.RedisError:
+                logger.exception('Could not enqueue update')
+                self.send_response(503)
+            else:
+                self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookRequestHandler
+
+
+def run_worker(worker_index, worker_count, token, database_urls,
+               handle_update, partitions=PARTITIONS, metrics_port=None,
+               telegram_api_url=None):
+    if metrics_port:
+        start_metrics_server(metrics_port + 1 + worker_index)
+    # A worker handles its chats one at a time, so it only shares the
+    # global quota: waiting on one chat's quota would stall the others.
+    bot = throttle_bot(Bot(token, base_url=telegram_api_url),
+                       global_rate=GLOBAL_RATE / worker_count, chat_rate=None)
+    database = ShardRouter.from_urls(database_urls,
+                                     redis.Redis).get_tenant_shard()
+    consumer = f'worker-{worker_index}'
+    streams = [get_stream_key(partition) for partition in
+               get_worker_partitions(worker_index, worker_count, partitions)]
+    if not streams:
+        return
+
+    last_ids = {stream: '0' for stream in streams}
+    failures = 0
+    while True:
+        try:
+            response = database.xreadgroup(GROUP_NAME, consumer, last_ids,
+                                           count=READ_COUNT,
+                                           block=READ_BLOCK_MS)
+            for stream, entries in response:
+                stream = stream.decode('utf-8')
+                if not entries:
+                    last_ids[stream] = '>'
+                    continue
+                for entry_id, fields in entries:
+                    try:
+                        update_data = json.loads(fields[b'update'])
+                        handle_update(bot, Update.de_json(update_data, bot))
+                    except Exception:
+                        logger.exception('Update %s failed', entry_id)
+                    database.xack(stream, GROUP_NAME, entry_id)
+        except redis.RedisError:
+            failures += 1
+            delay = min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+            logger.exception('Worker %s lost redis, retrying in %s s',
+                             worker_index, delay)
+            time.sleep(delay)
+            # Entries read but not acked before the error are still
+            # pending for this consumer, so start over from them.
+            last_ids = {stream: '0' for stream in streams}
+            continue
+        failures = 0
+
+
+def run_webhook(token, database_urls, handle_update, host, port, secret_path,
+                workers, worker_offset=0, worker_count=None,
+                partitions=PARTITIONS, metrics_port=None,
+                telegram_api_url=None):
+    database = ShardRouter.from_urls(database_urls,
+                                     redis.Redis).get_tenant_shard()
+    create_groups(database, partitions)
+
+    worker_count = worker_count or workers
+    context = multiprocessing.get_context('fork')
+
+    def start_worker(worker_index):
+        process = context.Process(
+            target=run_worker,
+            args=(worker_index, worker_count, token, database_urls,
+                  handle_update, partitions, metrics_port, telegram_api_url),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    processes = {worker_index: start_worker(worker_index)
+                 for worker_index in range(worker_offset,
+                                           worker_offset + workers)}
+
+    request_handler = make_request_handler(database, secret_path, partitions)
+    server = ThreadingHTTPServer((host, port), request_handler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        while server_thread.is_alive():
+            time.sleep(SUPERVISE_INTERVAL)
+            for worker_index, process in processes.items():
+                # A worker without partitions exits with code 0 on purpose.
+                if process.exitcode:
+                    logger.warning('Worker %s exited with code %s, '
+                                   'restarting', worker_index,
+                                   process.exitcode)
+                    processes[worker_index] = start_worker(worker_index)
+    finally:
+        server.shutdown()
+        server.server_close()
+        for process in processes.values():
+            process.terminate()